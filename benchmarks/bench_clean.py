@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""Article cleaning benchmark:
+Times the extraction of the largest articles of a dump, with templates
+expanded from the dump itself, and then of each of them repeated so as to
+double, quadruple, ... its size, to check that time grows linearly with size.
+"""
+
+import argparse
+import heapq
+import logging
+import os.path
+import sys
+from io import StringIO
+from timeit import default_timer
+
+from wikiextractor.WikiExtractor import decode_open, read_pages
+from wikiextractor.extract import Extractor, define_template
+
+
+def time_extract(title, text, repeat=1):
+    """
+    :return: the best time, over :param repeat: runs, of extracting text.
+    """
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        Extractor('0', '0', '', title, [text]).extract(StringIO())
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("input",
+                        help="XML wiki dump file")
+    parser.add_argument("--articles", type=int, default=10,
+                        help="number of largest articles to time (default %(default)s)")
+    parser.add_argument("--scale", type=int, default=3,
+                        help="number of times to double each article (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of each extraction (default %(default)s)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)  # no template errors
+    Extractor.templatePrefix = 'Template:'
+    Extractor.to_json = False
+    largest = []                # heap of (size, title, text)
+    with decode_open(args.input) as input:
+        for id, revid, title, redirect, page in read_pages(input):
+            text = ''.join(page)
+            if title.startswith(Extractor.templatePrefix):
+                define_template(title, page)
+            elif ':' not in title and not redirect:
+                heapq.heappush(largest, (len(text), title, text))
+                if len(largest) > args.articles:
+                    heapq.heappop(largest)
+
+    print("%-40s %10s %10s %10s" % ('article', 'KB', 'seconds', 'us/KB'))
+    for size, title, text in sorted(largest, reverse=True):
+        for scale in range(args.scale + 1):
+            page = text * 2 ** scale
+            elapsed = time_extract(title, page, args.repeat)
+            print("%-40s %10.1f %10.3f %10.1f" %
+                  (title[:40] if not scale else '  x%d' % 2 ** scale, len(page) / 1024,
+                   elapsed, elapsed * 1e6 / (len(page) / 1024)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""Decompressor benchmark:
+Times reading a compressed dump, as WikiExtractor does, with the Python
+modules and with each installed external decompressor for it, reporting MB
+per second of compressed and of decompressed text, and checks that they
+read the same text.
+"""
+
+import argparse
+import os.path
+import sys
+from timeit import default_timer
+
+from wikiextractor.WikiExtractor import decode_open, find_decompressor, inputDecompressors
+
+
+def time_decompressor(input_file, decompressor):
+    """
+    :return: (characters, lines, seconds)
+    """
+    chars = 0
+    lines = 0
+    start = default_timer()
+    with decode_open(input_file, decompressor=decompressor) as input:
+        for line in input:
+            chars += len(line)
+            lines += 1
+    return chars, lines, default_timer() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("input",
+                        help="compressed XML wiki dump file, .bz2 or .gz")
+    args = parser.parse_args()
+
+    decompressors = ['python'] + [name for name, _, _ in inputDecompressors
+                                  if find_decompressor(args.input, name)]
+    size = os.path.getsize(args.input)
+    results = {}
+    for decompressor in decompressors:
+        chars, lines, elapsed = time_decompressor(args.input, decompressor)
+        results[decompressor] = (chars, lines)
+        print("%-8s %10.1f MB %8.1fs %8.2f MB/s compressed %8.2f MB/s text" %
+              (decompressor, chars / 1e6, elapsed, size / 1e6 / elapsed, chars / 1e6 / elapsed))
+    if len(set(results.values())) > 1:
+        print("decompressors read different text", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""Pattern micro-benchmark:
+Times calls to the functions of the extractor that match patterns built at run
+time, on template-heavy text: with the pattern registry of extract.py, and with
+the cache of the re module alone, both when the patterns are in the cache and
+when it is thrashed, by compiling before each call more distinct patterns
+than it holds, as an extraction does with the patterns of many templates.
+"""
+
+import argparse
+import os.path
+import re
+import sys
+from itertools import count, islice
+from timeit import default_timer
+
+from wikiextractor import extract
+from wikiextractor.extract import (Extractor, dropNested, dropDiscarded,
+                                   findBalanced, findMatchingBraces,
+                                   normalizeTitle, splitParts)
+
+# a template-heavy portion of an infobox
+sample = '''{{Infobox settlement
+| name = {{{name|{{PAGENAME}}}}}
+| image_flag = Flag of {{{1|Italy}}}.svg
+| population_total = {{formatnum:{{#expr: 1000 * {{{pop|3}}} }}}}
+| coordinates = {{coord|43|46|N|11|15|E|region:IT|display=inline,title}}
+| website = [http://www.comune.fi.it/ comune.fi.it]
+| footnotes = <ref name="istat">{{cite web|url=http://www.istat.it|title=ISTAT}}</ref>
+}}
+{| class="wikitable"
+|-
+| [[Florence]] || {{flagicon|ITA}} || <small>{{convert|102|km2|sqmi}}</small>
+|}
+<gallery>File:Firenze.jpg|[[Duomo]]</gallery>
+'''
+
+calls = {
+    'dropNested': lambda text: dropNested(text, r'{{', r'}}'),
+    'dropDiscarded': dropDiscarded,
+    'findMatchingBraces': lambda text: list(findMatchingBraces(text, 2)),
+    'findBalanced': lambda text: list(findBalanced(text, ['[['], [']]'])),
+    'splitParts': lambda text: splitParts(text[2:-2]),
+    'normalizeTitle': lambda text: normalizeTitle('Template:infobox_settlement'),
+    'templateParams': lambda text: Extractor('0', '0', '', 'Florence', []).templateParams(
+        splitParts(text[2:-2])[1:]),
+}
+
+
+fillers = count()                # numbers of the patterns compiled to thrash
+
+
+def thrash():
+    """
+    Compile more new patterns than the cache of the re module holds, so that
+    the patterns compiled before are evicted from it.
+    """
+    for n in islice(fillers, getattr(re, '_MAXCACHE', 512) + 1):
+        re.compile('filler%d' % n)
+
+
+def time_call(function, text, count, thrashed):
+    """
+    :return: the average time of a call in microseconds, excluding the time to
+        thrash the re cache.
+    """
+    function(text)              # warm up
+    elapsed = 0.0
+    for _ in range(count):
+        if thrashed:
+            thrash()
+        start = default_timer()
+        function(text)
+        elapsed += default_timer() - start
+    return elapsed / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("--count", type=int, default=2000,
+                        help="number of calls to each function (default %(default)s)")
+    parser.add_argument("--thrashed-count", type=int, default=100,
+                        help="number of calls to each function with the re cache thrashed, "
+                        "which takes long to do (default %(default)s)")
+    args = parser.parse_args()
+
+    Extractor.templatePrefix = 'Template:'
+    print("%-20s %10s %10s %10s %10s" % ('function', 'registry', '+thrash', 're cache', '+thrash'))
+    registry = extract.compiled
+    for name, function in calls.items():
+        # the registry does not depend on the re cache, but thrashing it also
+        # evicts the caches of the processor
+        kept = time_call(function, sample, args.count, False)
+        kept_thrashed = time_call(function, sample, args.thrashed_count, True)
+        # patterns compiled through the re cache
+        extract.compiled = lambda pattern, flags=0: re.compile(pattern, flags)
+        try:
+            cached = time_call(function, sample, args.count, False)
+            thrashed = time_call(function, sample, args.thrashed_count, True)
+        finally:
+            extract.compiled = registry
+        print("%-20s %8.1fus %8.1fus %8.1fus %8.1fus" % (name, kept, kept_thrashed, cached, thrashed))
+
+
+if __name__ == '__main__':
+    main()
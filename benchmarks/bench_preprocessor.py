@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""Preprocessor benchmark:
+Times the extraction of the articles of a dump, with templates expanded from
+the dump itself, with each of the preprocessors of the extractor, and counts
+the articles whose text differs between them.
+"""
+
+import argparse
+import logging
+import os.path
+import sys
+from io import StringIO
+from timeit import default_timer
+
+from wikiextractor.WikiExtractor import decode_open, read_pages
+from wikiextractor.extract import Extractor, define_template, templateCache
+
+
+def time_preprocessor(preprocessor, articles):
+    """
+    :param articles: a list of (title, text).
+    :return: (seconds, list of extracted texts)
+    """
+    Extractor.preprocessor = preprocessor
+    templateCache.clear()       # parsed templates differ
+    texts = []
+    start = default_timer()
+    for title, text in articles:
+        out = StringIO()
+        Extractor('0', '0', '', title, [text]).extract(out)
+        texts.append(out.getvalue())
+    return default_timer() - start, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("input",
+                        help="XML wiki dump file")
+    parser.add_argument("--limit", type=int, default=0,
+                        help="maximum number of articles to extract (default all)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)  # no template errors
+    Extractor.templatePrefix = 'Template:'
+    Extractor.to_json = False
+    articles = []
+    with decode_open(args.input) as input:
+        for id, revid, title, redirect, page in read_pages(input):
+            if title.startswith(Extractor.templatePrefix):
+                define_template(title, page)
+            elif ':' not in title and not redirect:
+                if not args.limit or len(articles) < args.limit:
+                    articles.append((title, ''.join(page)))
+
+    size = sum(len(text) for _, text in articles) / 1e6
+    results = {}
+    for preprocessor in ('regex', 'tree'):
+        elapsed, results[preprocessor] = time_preprocessor(preprocessor, articles)
+        print("%-8s %8d articles %8.1f MB %8.1fs %8.2f MB/s" %
+              (preprocessor, len(articles), size, elapsed, size / elapsed))
+    differ = sum(a != b for a, b in zip(results['regex'], results['tree']))
+    print("%d articles differ" % differ)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""Page reader benchmark:
+Times each of the page readers of WikiExtractor on a dump, reporting pages
+and MB of page text per second, and checks that they produce the same pages.
+
+Use an uncompressed dump to time the reader rather than the decompressor.
+"""
+
+import argparse
+import os.path
+import sys
+from timeit import default_timer
+
+from wikiextractor.WikiExtractor import decode_open, pageReaders
+
+
+def time_reader(input_file, reader, limit=0):
+    """
+    :param limit: stop after this many pages, 0 for no limit.
+    :return: (pages, bytes of text, seconds, checksum of ids and titles)
+    """
+    pages = 0
+    size = 0
+    checksum = 0
+    start = default_timer()
+    with decode_open(input_file) as input:
+        for id, revid, title, redirect, page in pageReaders[reader](input):
+            pages += 1
+            size += sum(len(line) for line in page)
+            checksum = hash((checksum, id, revid, title, redirect))
+            if pages == limit:
+                break
+    return pages, size, default_timer() - start, checksum
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("input",
+                        help="XML wiki dump file")
+    parser.add_argument("--readers", default=','.join(sorted(pageReaders)),
+                        help="comma separated readers to compare (default %(default)s)")
+    parser.add_argument("--limit", type=int, default=0,
+                        help="maximum number of pages to read (default all)")
+    args = parser.parse_args()
+
+    results = {}
+    for reader in args.readers.split(','):
+        pages, size, elapsed, checksum = time_reader(args.input, reader, args.limit)
+        results[reader] = (pages, size, checksum)
+        print("%-8s %10d pages %10.1f MB %8.1fs %10.1f pages/s %8.2f MB/s" %
+              (reader, pages, size / 1e6, elapsed, pages / elapsed,
+               size / 1e6 / elapsed))
+    if len(set(results.values())) > 1:
+        print("readers produced different pages", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
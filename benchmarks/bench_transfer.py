@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""Page transfer benchmark:
+Times passing the pages of a dump to consumer processes, either pickled
+through the jobs queue or through a buffer in shared memory, as done by
+WikiExtractor with option --shared-buffer.
+Consumers only decode the text of pages, so that the time measured is that of
+the transfer. Reports the CPU time of the parent process, which reads the dump
+and dispatches pages, and the throughput.
+"""
+
+import argparse
+import os.path
+import sys
+import threading
+import time
+from multiprocessing import Queue, get_context
+from timeit import default_timer
+
+from wikiextractor.WikiExtractor import (decode_open, collect_pages, make_job,
+                                         parse_size, PageRing)
+
+
+def consume(jobs_queue, done_queue, ring):
+    size = 0
+    while True:
+        job = jobs_queue.get()
+        if not job:
+            break
+        urlbase, pages, ordinal, region, skip = job
+        if region:
+            pages = ring.get(pages, region)
+        size += sum(len(''.join(page)) for _, _, _, page in pages)
+    done_queue.put(size)
+
+
+def watch(consumers, done):
+    """
+    Exit if a consumer fails, since the parent would otherwise wait forever for
+    room in the jobs queue or in the buffer, or for the consumer's report.
+    :param done: event set once the consumers have reported.
+    """
+    while not done.wait(0.5):
+        for p in consumers:
+            if p.exitcode:
+                for q in consumers:
+                    q.terminate()
+                print("consumer process exited with code %d" % p.exitcode, file=sys.stderr)
+                os._exit(1)
+
+
+def time_transfer(batches, processes, ring_size):
+    """
+    :param batches: list of batches of pages.
+    :param ring_size: size of the shared buffer, 0 to use the queue alone.
+    :return: (characters received, seconds, parent CPU seconds)
+    """
+    context = get_context("fork")
+    jobs_queue = Queue(maxsize=10 * processes)
+    done_queue = Queue()
+    ring = PageRing(context, ring_size, 40 * processes) if ring_size else None
+    consumers = [context.Process(target=consume, args=(jobs_queue, done_queue, ring))
+                 for _ in range(processes)]
+    for p in consumers:
+        p.start()
+    done = threading.Event()
+    threading.Thread(target=watch, args=(consumers, done), daemon=True).start()
+    start = default_timer()
+    cpu_start = time.process_time()
+    for ordinal, batch in enumerate(batches):
+        jobs_queue.put(make_job('', batch, ordinal, ring))
+    for _ in consumers:
+        jobs_queue.put(None)
+    size = sum(done_queue.get() for _ in consumers)
+    done.set()
+    elapsed = default_timer() - start
+    cpu = time.process_time() - cpu_start
+    for p in consumers:
+        p.join()
+    if ring:
+        ring.close()
+    return size, elapsed, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("input",
+                        help="XML wiki dump file")
+    parser.add_argument("--processes", type=int, default=4,
+                        help="number of consumer processes (default %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=10,
+                        help="number of pages per job (default %(default)s)")
+    parser.add_argument("--shared-buffer", default="64M", metavar="n[KMG]",
+                        help="size of the shared buffer (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of each method (default %(default)s)")
+    args = parser.parse_args()
+
+    # read the dump beforehand, so that only the transfer is timed
+    batches = []
+    with decode_open(args.input) as input:
+        batch = []
+        for page in collect_pages(input):
+            batch.append(page)
+            if len(batch) == args.batch_size:
+                batches.append(batch)
+                batch = []
+        if batch:
+            batches.append(batch)
+
+    for name, ring_size in (('queue', 0), ('shared', parse_size(args.shared_buffer))):
+        best = None
+        for _ in range(args.repeat):
+            size, elapsed, cpu = time_transfer(batches, args.processes, ring_size)
+            if not best or elapsed < best[1]:
+                best = (size, elapsed, cpu)
+        size, elapsed, cpu = best
+        print("%-8s %10.1f MB %8.2fs %8.2fs parent CPU %8.1f MB/s" %
+              (name, size / 1e6, elapsed, cpu, size / 1e6 / elapsed))
+
+
+if __name__ == '__main__':
+    main()
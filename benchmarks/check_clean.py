@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""Golden file check of clean():
+Runs clean() on each article of benchmarks/samples/pages.xml, as text, with
+links kept and with HTML formatting, and compares the result with the one
+recorded in benchmarks/samples/pages.clean.txt, printing their differences.
+The exit status is 1 if they differ. run_suite.py performs the same check
+before timing anything.
+
+Use --update to record the output of the current version, after checking
+that the differences are intended.
+"""
+
+import argparse
+import difflib
+import logging
+import os.path
+import sys
+
+from wikiextractor.WikiExtractor import decode_open, read_pages
+from wikiextractor.extract import Extractor, clean
+
+samplesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+defaultInput = os.path.join(samplesDir, 'pages.xml')
+defaultGolden = os.path.join(samplesDir, 'pages.clean.txt')
+
+# (name, keepLinks, HtmlFormatting)
+modes = [
+    ('text', False, False),
+    ('links', True, False),
+    ('html', True, True),
+]
+
+
+def clean_pages(input_file):
+    """
+    :return: the text of each article of :param input_file: cleaned in each
+        of the modes, preceded by a line with its title and mode.
+    """
+    output = []
+    settings = (Extractor.templatePrefix, Extractor.keepLinks, Extractor.HtmlFormatting)
+    Extractor.templatePrefix = 'Template:'
+    try:
+        with decode_open(input_file) as input:
+            pages = [(id, revid, title, ''.join(page))
+                     for id, revid, title, redirect, page in read_pages(input)
+                     if not title.startswith(Extractor.templatePrefix) and not redirect]
+        for mode, links, html in modes:
+            Extractor.keepLinks = links
+            Extractor.HtmlFormatting = html
+            for id, revid, title, text in pages:
+                extractor = Extractor(id, revid, '', title, [text])
+                output.append('==== %s [%s] ====\n' % (title, mode))
+                output.append(clean(extractor, text))
+                output.append('\n')
+    finally:
+        Extractor.templatePrefix, Extractor.keepLinks, Extractor.HtmlFormatting = settings
+    return ''.join(output)
+
+
+def check_clean(input_file=defaultInput, golden_file=defaultGolden):
+    """
+    :return: the differences of the output of clean() on :param input_file:
+        from that recorded in :param golden_file:, as lines of a unified
+        diff, none if they match.
+    """
+    output = clean_pages(input_file)
+    with open(golden_file, encoding='utf-8') as file:
+        expected = file.read()
+    return list(difflib.unified_diff(expected.splitlines(True), output.splitlines(True),
+                                     golden_file, 'clean()'))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("--input", default=defaultInput,
+                        help="XML wiki dump file (default %(default)s)")
+    parser.add_argument("--golden", default=defaultGolden,
+                        help="file with the expected output (default %(default)s)")
+    parser.add_argument("--update", action="store_true",
+                        help="write the output to the golden file rather than comparing it")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    if args.update:
+        with open(args.golden, 'w', encoding='utf-8') as file:
+            file.write(clean_pages(args.input))
+        print("Wrote %s" % args.golden)
+        return
+    diff = check_clean(args.input, args.golden)
+    if not diff:
+        print("clean() output matches %s" % args.golden)
+        return
+    sys.stdout.writelines(diff)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""Synthetic dump generator:
+Writes a MediaWiki XML dump of random articles and templates, whose shape is
+controlled by the options, for use in benchmarks.
+
+The same options and seed always produce the same dump. The output is
+compressed if its name ends in .bz2.
+"""
+
+import argparse
+import bz2
+import math
+import os.path
+import random
+import sys
+from xml.sax.saxutils import escape
+
+header = """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+    <dbname>enwiki</dbname>
+    <base>https://en.wikipedia.org/wiki/Main_Page</base>
+    <generator>MediaWiki 1.35</generator>
+    <case>first-letter</case>
+    <namespaces>
+      <namespace key="0" case="first-letter" />
+      <namespace key="10" case="first-letter">Template</namespace>
+      <namespace key="14" case="first-letter">Category</namespace>
+      <namespace key="828" case="first-letter">Module</namespace>
+    </namespaces>
+  </siteinfo>
+"""
+
+pageFormat = """  <page>
+    <title>%s</title>
+    <ns>%d</ns>
+    <id>%d</id>
+    <revision>
+      <id>%d</id>
+      <timestamp>2020-01-01T00:00:00Z</timestamp>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text bytes="%d" xml:space="preserve">%s</text>
+    </revision>
+  </page>
+"""
+
+
+def escape_text(text):
+    """
+    Escape text as MediaWiki does in dumps, quotes included.
+    """
+    return escape(text, {'"': '&quot;'})
+
+
+# templates invoked by articles: (name, body, parameters of an invocation)
+leafTemplates = [
+    ('Flagicon', '[[File:Flag of {{{1}}}.svg|20px|link={{{1}}}]]&nbsp;{{{1}}}', '{0}'),
+    ('Convert', '{{{1}}}&nbsp;{{{2|km}}}{{#if:{{{abbr|}}}||}}', '{1}|{2}'),
+    ('Cite web', '{{#if:{{{url|}}}|[{{{url}}} {{{title|{{{url}}}}}}]}}{{#if:{{{date|}}}|, {{{date}}}}}.',
+     'url=http://example.org/{0}|title={0} {1}|date={2}'),
+    ('Lang', "<span lang=\"{{{1}}}\">''{{{2}}}''</span>", 'fr|{0}'),
+    ('Sort', '{{#switch:{{{1}}}|a=first|b=second|#default={{{2|{{{1}}}}}}}}', '{0}|{1}'),
+]
+
+
+def nestedTemplates(depth):
+    """
+    :return: templates Nest0, Nest1, ... each invoking the next one, down to
+        :param depth: levels.
+    """
+    templates = []
+    for level in range(depth):
+        inner = '{{Nest%d|{{{1}}}|n={{{n|%d}}}}}' % (level + 1, level) if level + 1 < depth else '{{{1}}}'
+        templates.append(('Nest%d' % level, '<span class="n{{{n|}}}">%s</span>' % inner, '{0}'))
+    return templates
+
+
+class Generator():
+    """Random text with a given density of templates and links."""
+
+    def __init__(self, rng, words, templates, template_density, link_density):
+        """
+        :param template_density: templates per 100 words.
+        :param link_density: links per 100 words.
+        """
+        self.rng = rng
+        self.words = words
+        self.templates = templates
+        self.template_density = template_density / 100
+        self.link_density = link_density / 100
+
+    def word(self):
+        return self.rng.choice(self.words)
+
+    def invocation(self):
+        name, _, params = self.rng.choice(self.templates)
+        return '{{%s|%s}}' % (name, params.format(self.word(), self.rng.randint(1, 999),
+                                                 '%d-01-01' % self.rng.randint(1900, 2020)))
+
+    def sentence(self):
+        tokens = []
+        for _ in range(self.rng.randint(5, 25)):
+            r = self.rng.random()
+            if r < self.template_density:
+                tokens.append(self.invocation())
+            elif r < self.template_density + self.link_density:
+                target = self.word().capitalize()
+                tokens.append('[[%s]]' % target if self.rng.random() < 0.5 else
+                              '[[%s|%s]]' % (target, self.word()))
+            else:
+                word = self.word()
+                r = self.rng.random()
+                tokens.append("'''%s'''" % word if r < 0.02 else "''%s''" % word if r < 0.04 else word)
+        sentence = ' '.join(tokens)
+        return sentence[0].upper() + sentence[1:] + '.'
+
+    def article(self, size):
+        """
+        :return: the text of an article of about :param size: characters.
+        """
+        paras = []
+        length = 0
+        section = 0
+        while length < size:
+            r = self.rng.random()
+            if r < 0.1:
+                section += 1
+                para = '== Section %d ==' % section
+            elif r < 0.15:
+                para = '\n'.join('* ' + self.sentence() for _ in range(self.rng.randint(2, 6)))
+            elif r < 0.17:
+                rows = '\n|-\n'.join('| %s || %s' % (self.word(), self.rng.randint(1, 99))
+                                     for _ in range(self.rng.randint(2, 5)))
+                para = '{| class="wikitable"\n|-\n%s\n|}' % rows
+            else:
+                para = ' '.join(self.sentence() for _ in range(self.rng.randint(2, 6)))
+                if self.rng.random() < 0.3:
+                    para += '<ref>%s</ref>' % self.invocation()
+            paras.append(para)
+            length += len(para) + 2
+        paras.append('== References ==\n<references/>\n\n[[Category:%s]]' % self.word().capitalize())
+        return '\n\n'.join(paras)
+
+
+def generate(out, pages, mean_size, sigma, template_density, link_density, depth, seed):
+    """
+    Write to :param out: a dump with :param pages: articles, whose sizes in
+    characters follow a log-normal distribution with median
+    :param mean_size: and shape :param sigma:.
+    :param depth: nesting depth of the templates Nest0, Nest1, ...
+    """
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 10)))
+             for _ in range(2000)]
+    templates = leafTemplates + nestedTemplates(depth)
+    generator = Generator(rng, words, templates, template_density, link_density)
+
+    out.write(header)
+    id = 0
+    for name, body, _ in templates:
+        id += 1
+        out.write(pageFormat % ('Template:' + name, 10, id, id, len(body), escape_text(body)))
+    mu = math.log(mean_size)
+    for i in range(pages):
+        id += 1
+        text = generator.article(int(rng.lognormvariate(mu, sigma)))
+        out.write(pageFormat % ('Article %d' % i, 0, id, id, len(text), escape_text(text)))
+    out.write('</mediawiki>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("output",
+                        help="dump file to write, '-' for stdout")
+    parser.add_argument("--pages", type=int, default=1000,
+                        help="number of articles (default %(default)s)")
+    parser.add_argument("--size", type=int, default=5000,
+                        help="median size of articles, in characters (default %(default)s)")
+    parser.add_argument("--size-sigma", type=float, default=1.0,
+                        help="shape of the log-normal distribution of sizes (default %(default)s)")
+    parser.add_argument("--template-density", type=float, default=2.0,
+                        help="template invocations per 100 words (default %(default)s)")
+    parser.add_argument("--link-density", type=float, default=5.0,
+                        help="links per 100 words (default %(default)s)")
+    parser.add_argument("--depth", type=int, default=3,
+                        help="nesting depth of templates (default %(default)s)")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed (default %(default)s)")
+    args = parser.parse_args()
+
+    if args.output == '-':
+        out = sys.stdout
+    elif args.output.endswith('.bz2'):
+        out = bz2.open(args.output, 'wt', encoding='utf-8')
+    else:
+        out = open(args.output, 'w', encoding='utf-8')
+    generate(out, args.pages, args.size, args.size_sigma, args.template_density,
+             args.link_density, max(1, args.depth), args.seed)
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
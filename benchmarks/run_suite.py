@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""Benchmark suite:
+Times, on each dump, the page readers, the loading of templates, the
+extraction of each article with each preprocessor, and whole runs of
+WikiExtractor with several numbers of processes, and writes the results in
+JSON, so that they can be compared across versions.
+
+By default the dumps are the page samples in benchmarks/samples and a
+synthetic dump made by gen_dump.py. With --compare, results are compared
+with those of a previous run, and the exit status is 1 if any benchmark got
+slower by more than --threshold.
+
+Before timing anything, the output of clean() is checked against the golden
+file of check_clean.py: the exit status is 1 if it differs, since timings of
+an extractor producing different text are not comparable.
+"""
+
+import argparse
+import json
+import logging
+import os.path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+from timeit import default_timer
+
+from gen_dump import generate
+from bench_reader import time_reader
+from check_clean import check_clean
+
+from wikiextractor import extract
+from wikiextractor.WikiExtractor import __version__, decode_open, load_templates, pageReaders, read_pages
+from wikiextractor.extract import Extractor, templateCache
+
+samplesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+
+
+def best(function, repeat):
+    """
+    :return: the best time of :param repeat: calls of :param function:, and
+        its last result.
+    """
+    times = []
+    for _ in range(repeat):
+        start = default_timer()
+        result = function()
+        times.append(default_timer() - start)
+    return min(times), result
+
+
+def reset_templates():
+    extract.templates.clear()
+    extract.redirects.clear()
+    templateCache.clear()
+
+
+def bench_templates(dump, repeat):
+    def load():
+        reset_templates()
+        with decode_open(dump) as input:
+            return load_templates(input)
+    seconds, count = best(load, repeat)
+    return {'seconds': seconds, 'templates': count}
+
+
+def bench_articles(dump, preprocessor, repeat):
+    """
+    Time the extraction of each article, with templates from the dump.
+    """
+    reset_templates()
+    with decode_open(dump) as input:
+        load_templates(input)
+    articles = []
+    with decode_open(dump) as input:
+        for id, revid, title, redirect, page in read_pages(input):
+            if ':' not in title and not redirect:
+                articles.append((id, revid, title, page))
+    Extractor.preprocessor = preprocessor
+    times = []
+    for id, revid, title, page in articles:
+        def run():
+            Extractor(id, revid, '', title, page).extract(StringIO())
+        times.append(best(run, repeat)[0])
+    Extractor.preprocessor = 'regex'
+    times.sort()
+    size = sum(len(line) for _, _, _, page in articles for line in page)
+    total = sum(times)
+    return {'seconds': total, 'articles': len(times), 'MB/s': size / 1e6 / total if total else 0,
+            'p50': times[len(times) // 2] if times else 0,
+            'p90': times[len(times) * 9 // 10] if times else 0,
+            'max': times[-1] if times else 0}
+
+
+def bench_run(dump, processes, repeat):
+    """
+    Time a whole run of WikiExtractor, in a separate interpreter.
+    """
+    def run():
+        with tempfile.TemporaryDirectory() as output:
+            subprocess.run([sys.executable, '-m', 'wikiextractor.WikiExtractor', dump, '-q',
+                            '--processes', str(processes), '-o', output], check=True)
+    seconds, _ = best(run, repeat)
+    return {'seconds': seconds}
+
+
+def run_suite(dumps, process_counts, repeat):
+    """
+    :return: a list of results, each a dict with keys 'benchmark', 'dump'
+        and 'seconds', besides others specific to the benchmark.
+    """
+    results = []
+
+    def record(benchmark, dump, result, **params):
+        result.update(benchmark=benchmark, dump=os.path.basename(dump), **params)
+        results.append(result)
+        print('%-10s %-24s %-20s %8.3fs' %
+              (benchmark, os.path.basename(dump)[:24],
+               ' '.join('%s=%s' % x for x in params.items()), result['seconds']), file=sys.stderr)
+
+    for dump in dumps:
+        for reader in sorted(pageReaders):
+            seconds, (pages, size, _, _) = best(lambda: time_reader(dump, reader), repeat)
+            record('reader', dump, {'seconds': seconds, 'pages': pages, 'MB/s': size / 1e6 / seconds},
+                   reader=reader)
+        record('templates', dump, bench_templates(dump, repeat))
+        for preprocessor in ('regex', 'tree'):
+            record('articles', dump, bench_articles(dump, preprocessor, repeat),
+                   preprocessor=preprocessor)
+        for processes in process_counts:
+            record('run', dump, bench_run(dump, processes, repeat), processes=processes)
+    return results
+
+
+def key(result):
+    return tuple(sorted((k, v) for k, v in result.items()
+                        if isinstance(v, str) or k == 'processes'))
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the ratio of the time of each of :param results: to that in
+    :param baseline:.
+    :return: the number of benchmarks slower by more than :param threshold:.
+    """
+    previous = {key(result): result for result in baseline['results']}
+    regressions = 0
+    print('%-10s %-24s %-20s %9s %9s %7s' % ('benchmark', 'dump', '', 'before', 'after', 'ratio'))
+    for result in results:
+        old = previous.get(key(result))
+        if not old:
+            continue
+        ratio = result['seconds'] / old['seconds'] if old['seconds'] else 1.0
+        slower = ratio > 1 + threshold
+        regressions += slower
+        params = ' '.join('%s=%s' % (k, v) for k, v in key(result)
+                          if k not in ('benchmark', 'dump'))
+        print('%-10s %-24s %-20s %8.3fs %8.3fs %6.2fx%s' %
+              (result['benchmark'], result['dump'][:24], params, old['seconds'],
+               result['seconds'], ratio, '  SLOWER' if slower else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=__doc__)
+    parser.add_argument("dumps", nargs='*',
+                        help="XML dump files (default the samples and a synthetic dump)")
+    parser.add_argument("--processes", default="1,2,4",
+                        help="comma separated numbers of processes of whole runs (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of each benchmark, of which the best is kept (default %(default)s)")
+    parser.add_argument("--pages", type=int, default=500,
+                        help="number of articles of the synthetic dump (default %(default)s)")
+    parser.add_argument("-o", "--output",
+                        help="file where to write the results in JSON (default stdout)")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown beyond which a benchmark counts as a regression (default %(default)s)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)  # no template errors
+    Extractor.to_json = False
+
+    diff = check_clean()
+    if diff:
+        sys.stderr.writelines(diff)
+        print("clean() output differs from the golden file, see check_clean.py", file=sys.stderr)
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dumps = args.dumps
+        if not dumps:
+            dumps = [os.path.join(samplesDir, name) for name in sorted(os.listdir(samplesDir))
+                     if name.endswith('.xml')]
+            synthetic = os.path.join(tmp, 'synthetic.xml')
+            with open(synthetic, 'w', encoding='utf-8') as out:
+                generate(out, args.pages, 5000, 1.0, 2.0, 5.0, 3, seed=1)
+            dumps.append(synthetic)
+        process_counts = [int(n) for n in args.processes.split(',')]
+        results = run_suite(dumps, process_counts, max(1, args.repeat))
+
+    report = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -55,15 +55,47 @@ collecting template definitions.
 
 import argparse
 import bz2
+import gc
+import gzip
+import heapq
+import io
+import json
 import logging
+import mmap
 import os.path
+import queue
 import re  # TODO use regex when it will be standard
+import shutil
+import subprocess
 import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from itertools import islice
 from io import StringIO
+from xml.parsers import expat
 from multiprocessing import Queue, get_context, cpu_count
 from timeit import default_timer
+try:
+    from multiprocessing import shared_memory
+except ImportError:             # Python < 3.8
+    shared_memory = None
+try:
+    import resource
+except ImportError:             # Windows
+    resource = None
+try:
+    import lzma
+except ImportError:             # Python built without liblzma
+    lzma = None
 
 from .extract import Extractor, ignoreTag, define_template, acceptedNamespaces
+from .extract import save_template_db, use_template_db, preload_templates
+from .extract import templateCache, expansionCache, Profile, get_url
+from .docindex import DocIndexPart, byte_spans, write_doc_index
 
 # ===========================================================================
 
@@ -120,8 +152,9 @@ class NextFile():
 
     filesPerDir = 100
 
-    def __init__(self, path_name):
+    def __init__(self, path_name, prefix='wiki_'):
         self.path_name = path_name
+        self.prefix = prefix
         self.dir_index = -1
         self.file_index = -1
 
@@ -140,7 +173,43 @@ class NextFile():
         return os.path.join(self.path_name, '%c%c' % (ord('A') + char2, ord('A') + char1))
 
     def _filepath(self):
-        return '%s/wiki_%02d' % (self._dirname(), self.file_index)
+        return '%s/%s%02d' % (self._dirname(), self.prefix, self.file_index)
+
+
+##
+# Codecs for output files: extension, function compressing data at a level,
+# default level.
+outputCodecs = {
+    'bz2': ('.bz2', lambda data, level: bz2.compress(data, level), 9),
+    'gzip': ('.gz', lambda data, level: gzip.compress(data, level), 9),
+}
+if lzma:
+    outputCodecs['lzma'] = ('.xz', lambda data, level: lzma.compress(data, preset=level), 6)
+
+
+class Compressor():
+
+    """
+    Compression of output text in independent chunks, each into a complete
+    stream, so that extract processes compress in parallel and the streams
+    are simply concatenated into files: bzip2, gzip and xz tools all read
+    concatenated streams as one.
+    """
+
+    def __init__(self, codec='bz2', level=None):
+        """
+        :param codec: the name of the codec, see outputCodecs.
+        :param level: the compression level, None for the default one.
+        """
+        self.extension, self.function, default = outputCodecs[codec]
+        self.level = default if level is None else level
+        self.function(b'', self.level)  # raises ValueError for a bad level
+
+    def __call__(self, text):
+        """
+        :return: the compressed stream of :param text:.
+        """
+        return self.function(text.encode('utf-8'), self.level)
 
 
 class OutputSplitter():
@@ -149,38 +218,251 @@ class OutputSplitter():
     File-like object, that splits output to multiple files of a given max size.
     """
 
-    def __init__(self, nextFile, max_file_size=0, compress=True):
+    def __init__(self, nextFile, max_file_size=0, compress=None):
         """
         :param nextFile: a NextFile object from which to obtain filenames
             to use.
         :param max_file_size: the maximum size of each file.
-        :para compress: whether to write data with bzip compression.
+        :param compress: the Compressor of the data written, which is then
+            compressed bytes, or None for text.
         """
         self.nextFile = nextFile
         self.compress = compress
         self.max_file_size = max_file_size
         self.file = self.open(self.nextFile.next())
+        self.offset = 0  # where the last data was written
 
     def reserve(self, size):
+        # the size of compressed files is the one on disk
         if self.file.tell() + size > self.max_file_size:
             self.close()
             self.file = self.open(self.nextFile.next())
 
     def write(self, data):
         self.reserve(len(data))
-        if self.compress:
-            self.file.write(data)
-        else:
-            self.file.write(data)
+        self.offset = self.file.tell()
+        self.file.write(data)
 
     def close(self):
+        if self.compress and not self.file.tell():
+            # an empty file is not a valid compressed file
+            self.file.write(self.compress(''))
         self.file.close()
 
     def open(self, filename):
         if self.compress:
-            return bz2.BZ2File(filename + '.bz2', 'w')
+            filename += self.compress.extension
+        self.filename = filename
+        if self.compress:
+            return open(filename, 'wb')
+        else:
+            return open(filename, 'w', encoding='utf-8')
+
+
+class ShardedOutput():
+
+    """
+    Output written by each extract process straight to its own series of
+    files, e.g. AA/wiki_w03_00, AA/wiki_w03_01, ..., rather than through the
+    reduce process, hence in no particular order.
+    The series of a process which is replaced is continued by its successor.
+    Each series records its complete files in a part of the manifest, and
+    the parts are finally merged into manifest.json, listing the files with
+    the number of documents they hold and their size.
+    """
+
+    manifest = 'manifest.json'
+
+    def __init__(self, context, path_name, series, max_file_size, compress=None, doc_index=False):
+        """
+        :param context: the multiprocessing context.
+        :param path_name: the output directory.
+        :param series: number of series of files.
+        :param max_file_size: the maximum size of each file.
+        :param compress: the Compressor of the data written, which is then
+            compressed bytes, or None for text.
+        :param doc_index: whether to record the documents written, in a
+            DocIndexPart for each series.
+        """
+        self.path_name = path_name
+        self.max_file_size = max_file_size
+        self.compress = compress
+        self.index_parts = None
+        if doc_index:
+            self.index_parts = [DocIndexPart(os.path.join(path_name, 'docs_w%02d' % i))
+                                for i in range(series)]
+            for part in self.index_parts:
+                part.clear()
+        # shared by the processes writing a series in turn
+        self.files = context.RawArray('q', series)  # index of its current file
+        self.docs = context.RawArray('q', series)  # documents in it
+        # of this process
+        self.file = None
+        self.filename = None
+        for series in range(series):
+            if os.path.exists(self.part(series)):  # left by an interrupted run
+                os.remove(self.part(series))
+
+    def part(self, series):
+        return os.path.join(self.path_name, 'manifest_w%02d.part' % series)
+
+    def open(self, series):
+        nextFile = NextFile(self.path_name, 'wiki_w%02d_' % series)
+        nextFile.dir_index, nextFile.file_index = divmod(self.files[series] - 1, NextFile.filesPerDir)
+        self.filename = nextFile.next() + (self.compress.extension if self.compress else '')
+        # appending to what a killed predecessor wrote, if any
+        mode = 'a' if self.docs[series] else 'w'
+        if self.compress:
+            self.file = open(self.filename, mode + 'b')
         else:
-            return open(filename, 'w')
+            self.file = open(self.filename, mode, encoding='utf-8')
+
+    def write(self, series, data, docs, spans=None):
+        """
+        Write :param data: holding :param docs: documents to :param series:.
+        :param spans: the byte spans of the documents, for the index.
+        With a list of data, as output by job_output() for each article, and
+        the list of their spans, each is written as a document of its own.
+        """
+        if isinstance(data, list):
+            for piece, piece_spans in zip(data, spans):
+                self.write(series, piece, 1, piece_spans)
+            return
+        if not self.file:
+            self.open(series)
+        elif self.docs[series] and self.file.tell() + len(data) > self.max_file_size:
+            self.close(series)
+            self.open(series)
+        offset = self.file.tell()
+        self.file.write(data)
+        # complete, in case this process is killed
+        self.file.flush()
+        self.docs[series] += docs
+        if spans:
+            self.index_parts[series].add(os.path.relpath(self.filename, self.path_name),
+                                         offset, self.file.tell() - offset, spans)
+
+    def close(self, series):
+        """
+        Close the current file of :param series:, and record it.
+        """
+        if not self.file:
+            return
+        self.file.close()
+        self.file = None
+        if self.index_parts:
+            self.index_parts[series].close()
+        if self.docs[series]:
+            with open(self.part(series), 'a') as part:
+                part.write(json.dumps({'file': os.path.relpath(self.filename, self.path_name),
+                                       'docs': self.docs[series]}) + '\n')
+            self.files[series] += 1
+            self.docs[series] = 0
+
+    def write_manifest(self):
+        """
+        Merge the parts of the manifest into manifest.json.
+        :return: the number of files and of documents.
+        """
+        shards = []
+        for series in range(len(self.files)):
+            part = self.part(series)
+            if not os.path.exists(part):
+                continue
+            with open(part) as file:
+                for line in file:
+                    shard = json.loads(line)
+                    shard['bytes'] = os.path.getsize(os.path.join(self.path_name, shard['file']))
+                    shards.append(shard)
+            os.remove(part)
+        shards.sort(key=lambda shard: shard['file'])
+        docs = sum(shard['docs'] for shard in shards)
+        manifest = {
+            'shards': shards,
+            'docs': docs,
+            'bytes': sum(shard['bytes'] for shard in shards)
+        }
+        path = os.path.join(self.path_name, ShardedOutput.manifest)
+        temp = path + '.tmp'
+        with open(temp, 'w') as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(temp, path)
+        return len(shards), docs
+
+
+class Checkpoint():
+
+    """
+    Manifest of the progress of an extraction, saved in the output directory
+    each time an output file is completed, so that the extraction can be
+    resumed from there.
+    """
+
+    filename = 'checkpoint.json'
+
+    def __init__(self, path_name, input_file, index=False):
+        """
+        :param path_name: the output directory.
+        :param input_file: name of the dump being extracted.
+        :param index: whether the dump is read in blocks, of a multistream
+            dump or split.
+        """
+        self.path = os.path.join(path_name, Checkpoint.filename)
+        self.input_file = os.path.basename(input_file)
+        self.index = index
+        self.articles = 0  # articles in completed files
+        self.blocks = 0  # multistream blocks in completed files
+        self.dir_index = -1  # last completed file, as in NextFile
+        self.file_index = -1
+        self.finished = False
+        self.start = (0, 0)  # (articles, blocks) when resumed
+
+    def load(self):
+        """
+        Load the manifest of a previous run, if present.
+        :return: whether it was present.
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as file:
+            state = json.load(file)
+        if state['input'] != self.input_file or state['index'] != self.index:
+            raise ValueError("%s was written extracting %s %s a multistream index" %
+                             (self.path, state['input'], 'with' if state['index'] else 'without'))
+        self.articles = state['articles']
+        self.blocks = state['blocks']
+        self.dir_index = state['dir_index']
+        self.file_index = state['file_index']
+        self.finished = state['finished']
+        self.start = (self.articles, self.blocks)
+        return True
+
+    def commit(self, articles, blocks, completed, finished=False):
+        """
+        Record that output files are complete up to :param completed:, the
+        (dir_index, file_index) of the last one, with :param articles: and
+        :param blocks: written since the start of this run.
+        """
+        self.articles = self.start[0] + articles
+        self.blocks = self.start[1] + blocks if self.index else 0
+        self.dir_index, self.file_index = completed
+        self.finished = finished
+        state = {
+            'input': self.input_file,
+            'index': self.index,
+            'articles': self.articles,
+            'blocks': self.blocks,
+            'dir_index': self.dir_index,
+            'file_index': self.file_index,
+            'finished': self.finished
+        }
+        # write aside and rename, so that a crash leaves the previous manifest
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.path)
 
 
 # ----------------------------------------------------------------------
@@ -190,10 +472,11 @@ tagRE = re.compile(r'(.*?)<(/?\w+)[^>]*>(?:([^<]*)(<.*?>)?)?')
 #                    1     2               3      4
 
 
-def load_templates(file, output_file=None):
+def load_templates(file, output_file=None, reader='regex'):
     """
     Load templates from :param file:.
     :param output_file: file where to save templates and modules.
+    :param reader: the name of the page reader to use, see pageReaders.
     :return: number of templates loaded.
     """
     global templateNamespace
@@ -201,75 +484,118 @@ def load_templates(file, output_file=None):
     modulePrefix = moduleNamespace + ':'
     articles = 0
     templates = 0
-    page = []
-    inText = False
     if output_file:
         output = open(output_file, 'w')
-    for line in file:
-        #line = line.decode('utf-8')
-        if '<' not in line:  # faster than doing re.search()
-            if inText:
-                page.append(line)
-            continue
-        m = tagRE.search(line)
-        if not m:
-            continue
-        tag = m.group(2)
-        if tag == 'page':
-            page = []
-        elif tag == 'title':
-            title = m.group(3)
-            if not output_file and not templateNamespace:  # do not know it yet
-                # we reconstruct it from the first title
-                colon = title.find(':')
-                if colon > 1:
-                    templateNamespace = title[:colon]
-                    Extractor.templatePrefix = title[:colon + 1]
-            # FIXME: should reconstruct also moduleNamespace
-        elif tag == 'text':
-            inText = True
-            line = line[m.start(3):m.end(3)]
-            page.append(line)
-            if m.lastindex == 4:  # open-close
-                inText = False
-        elif tag == '/text':
-            if m.group(1):
-                page.append(m.group(1))
-            inText = False
-        elif inText:
-            page.append(line)
-        elif tag == '/page':
-            if title.startswith(Extractor.templatePrefix):
-                define_template(title, page)
-                templates += 1
-            # save templates and modules to file
-            if output_file and (title.startswith(Extractor.templatePrefix) or
-                                title.startswith(modulePrefix)):
-                output.write('<page>\n')
-                output.write('   <title>%s</title>\n' % title)
-                output.write('   <ns>10</ns>\n')
-                output.write('   <text>')
-                for line in page:
-                    output.write(line)
-                output.write('   </text>\n')
-                output.write('</page>\n')
-            page = []
-            articles += 1
-            if articles % 100000 == 0:
-                logging.info("Preprocessed %d pages", articles)
+    for id, revid, title, redirect, page in pageReaders[reader](file):
+        if not output_file and not templateNamespace:  # do not know it yet
+            # we reconstruct it from the first title
+            colon = title.find(':')
+            if colon > 1:
+                templateNamespace = title[:colon]
+                Extractor.templatePrefix = title[:colon + 1]
+        # FIXME: should reconstruct also moduleNamespace
+        if title.startswith(Extractor.templatePrefix):
+            define_template(title, page)
+            templates += 1
+        # save templates and modules to file
+        if output_file and (title.startswith(Extractor.templatePrefix) or
+                            title.startswith(modulePrefix)):
+            output.write('<page>\n')
+            output.write('   <title>%s</title>\n' % title)
+            output.write('   <ns>10</ns>\n')
+            output.write('   <text>')
+            for line in page:
+                output.write(line)
+            output.write('   </text>\n')
+            output.write('</page>\n')
+        articles += 1
+        if articles % 100000 == 0:
+            logging.info("Preprocessed %d pages", articles)
     if output_file:
         output.close()
         logging.info("Saved %d templates to '%s'", templates, output_file)
     return templates
 
 
-def decode_open(filename, mode='rt', encoding='utf-8'):
+##
+# External programs that decompress in parallel, in order of preference:
+# (name, extension of the files they decompress, command line).
+inputDecompressors = [
+    ('lbzip2', '.bz2', ['lbzip2', '-d', '-c']),
+    ('pbzip2', '.bz2', ['pbzip2', '-d', '-c']),
+    ('pigz', '.gz', ['pigz', '-d', '-c']),
+]
+
+
+def find_decompressor(filename, decompressor='auto'):
+    """
+    :param filename: the file to decompress.
+    :param decompressor: the name of the external decompressor to use, 'auto'
+        for the first installed one, 'python' for none.
+    :return: (name, command line) of the decompressor, or None to decompress
+        with the Python modules.
+    """
+    if decompressor == 'python':
+        return None
+    ext = os.path.splitext(filename)[1]
+    for name, extension, command in inputDecompressors:
+        if extension == ext and decompressor in ('auto', name) and shutil.which(command[0]):
+            return name, command
+    return None
+
+
+class DecompressorPipe(io.RawIOBase):
+    """
+    Binary file reading the output of an external decompressor.
+    The decompressor reads the compressed file as its standard input, which
+    shares the position in the file with self.file.
+    """
+
+    def __init__(self, filename, command):
+        """
+        :param filename: the file to decompress.
+        :param command: the command line of the decompressor, which writes
+            to its standard output what it reads from its standard input.
+        """
+        self.name = filename
+        self.command = command
+        self.file = open(filename, 'rb')
+        self.process = subprocess.Popen(command, stdin=self.file, stdout=subprocess.PIPE, bufsize=0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self.process.stdout.readinto(buffer)
+        if not size and self.process.wait():
+            # rather than taking a truncated dump as complete
+            raise IOError("%s failed on %s with exit status %d" %
+                          (self.command[0], self.name, self.process.returncode))
+        return size
+
+    def close(self):
+        if not self.closed:
+            if self.process.poll() is None:
+                self.process.terminate()  # closed before the end
+            self.process.stdout.close()
+            self.process.wait()
+            self.file.close()
+        super().close()
+
+
+def decode_open(filename, mode='rt', encoding='utf-8', decompressor='python'):
     """
     Open a file, decode and decompress, depending on extension `gz`, or 'bz2`.
     :param filename: the file to open.
+    :param decompressor: the external decompressor to read a compressed file
+        through, see find_decompressor(), if installed.
     """
     ext = os.path.splitext(filename)[1]
-    if ext == '.gz':
+    external = find_decompressor(filename, decompressor) if mode == 'rt' else None
+    if external:
+        pipe = DecompressorPipe(filename, external[1])
+        return io.TextIOWrapper(io.BufferedReader(pipe, 1024 * 1024), encoding=encoding)
+    elif ext == '.gz':
         import gzip
         return gzip.open(filename, mode, encoding=encoding)
     elif ext == '.bz2':
@@ -278,16 +604,88 @@ def decode_open(filename, mode='rt', encoding='utf-8'):
         return open(filename, mode, encoding=encoding)
 
 
-def collect_pages(text):
+def raw_file(input):
+    """
+    :return: the binary file underlying :param input:, as opened by
+        decode_open(), whose position tells how much of the dump was read.
+    """
+    file = getattr(input, 'buffer', input)
+    if isinstance(getattr(file, 'raw', None), DecompressorPipe):
+        # shares its position with the external decompressor
+        return file.raw.file
+    # BZ2File and GzipFile do not expose the file they decompress
+    return getattr(file, '_fp', None) or getattr(file, 'fileobj', None) or file
+
+
+def read_multistream_index(index_file):
+    """
+    Read the index of a multistream dump, whose lines have the form
+    offset:id:title, where offset is the position of the bz2 stream holding
+    the page.
+    :param index_file: name of the index file.
+    :return: the list of distinct stream offsets, in file order.
+    """
+    offsets = []
+    last = -1
+    with decode_open(index_file) as index:
+        for line in index:
+            offset = int(line[:line.find(':')])
+            if offset != last:
+                offsets.append(offset)
+                last = offset
+    return offsets
+
+
+def split_dump(input_file, size):
+    """
+    Split an uncompressed dump into blocks of pages, which can be parsed
+    independently of each other.
+    :param input_file: name of the dump file.
+    :param size: the size in bytes of blocks: each ends at the first <page>
+        tag after it.
+    :return: the list of the offsets where blocks start, the first at the
+        first page.
+    """
+    offsets = []
+    with open(input_file, 'rb') as input:
+        with mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # markup in the text of pages is escaped, so this is a tag
+            offset = data.find(b'<page>')
+            while offset >= 0:
+                offsets.append(offset)
+                offset = data.find(b'<page>', offset + size)
+    return offsets
+
+
+def read_block(input, start, end, decompress=True):
+    """
+    Decompress the bz2 streams between byte offsets :param start: and
+    :param end: of a multistream dump.
+    :param input: the dump, opened in binary mode.
+    :param end: the offset where the block ends, None for end of file.
+    :param decompress: False for an uncompressed dump, split by split_dump().
+    :return: the decoded text of the block.
+    """
+    input.seek(start)
+    data = input.read(end - start) if end else input.read()
+    if decompress:
+        data = bz2.decompress(data)
+    return data.decode('utf-8')
+
+
+def read_pages(text):
     """
+    Scan the pages of a dump line by line, using tagRE.
     :param text: the text of a wikipedia file dump.
+    :return: an iterator on tuples (id, revid, title, redirect, page), where
+        page is the list of the lines of its text.
     """
     # we collect individual lines, since str.join() is significantly faster
     # than concatenation
     page = []
     id = ''
     revid = ''
-    last_id = ''
+    title = ''
     inText = False
     redirect = False
     for line in text:
@@ -302,9 +700,13 @@ def collect_pages(text):
         if tag == 'page':
             page = []
             redirect = False
+        elif tag == 'revision':
+            # keep the last one, in dumps with several revisions per page
+            revid = ''
+            page = []
         elif tag == 'id' and not id:
             id = m.group(3)
-        elif tag == 'id' and id: # <revision> <id></id> </revision>
+        elif tag == 'id' and not revid: # <revision> <id></id> </revision>
             revid = m.group(3)
         elif tag == 'title':
             title = m.group(3)
@@ -323,11 +725,7 @@ def collect_pages(text):
         elif inText:
             page.append(line)
         elif tag == '/page':
-            colon = title.find(':')
-            if (colon < 0 or (title[:colon] in acceptedNamespaces) and id != last_id and
-                    not redirect and not title.startswith(templateNamespace)):
-                yield (id, revid, title, page)
-                last_id = id
+            yield (id, revid, title, redirect, page)
             id = ''
             revid = ''
             page = []
@@ -335,17 +733,299 @@ def collect_pages(text):
             redirect = False
 
 
+def escape_xml(text):
+    """
+    Escape text as it appears in the elements of a dump.
+    """
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '>', '&gt;').replace('"', '&quot;')
+
+
+def read_pages_expat(text, chunk_size=1024 * 1024):
+    """
+    Scan the pages of a dump with an incremental expat parser, which, unlike
+    read_pages(), does not depend on how elements are laid out on lines and
+    deals with CDATA sections and character references.
+    Text and titles are escaped back, as they appear in the dump.
+    :param text: a file with the dump, or with a portion of it consisting of
+        whole pages (after <siteinfo>, or a multistream block).
+    :param chunk_size: amount of text fed to the parser at a time.
+    :return: an iterator on tuples (id, revid, title, redirect, page), where
+        page is a list holding its text.
+    """
+    pages = []                  # pages completed in the current chunk
+    path = []                   # open elements
+    chars = []                  # character data of current element
+    fields = {}                 # values of page fields
+
+    def start_element(name, attrs):
+        if name == 'page':
+            fields.clear()
+        elif name == 'redirect':
+            fields['redirect'] = True
+        elif name == 'revision':
+            # keep the last one, in dumps with several revisions per page
+            fields.pop('revid', None)
+            fields.pop('text', None)
+        path.append(name)
+        del chars[:]
+
+    def end_element(name):
+        path.pop()
+        if name == 'id':
+            parent = path[-1] if path else ''
+            if parent == 'page':
+                fields['id'] = ''.join(chars)
+            elif parent == 'revision' and 'revid' not in fields:
+                fields['revid'] = ''.join(chars)
+        elif name == 'title':
+            fields['title'] = escape_xml(''.join(chars))
+        elif name == 'text':
+            fields['text'] = escape_xml(''.join(chars))
+        elif name == 'page':
+            pages.append((fields.get('id', ''), fields.get('revid', ''),
+                          fields.get('title', ''), fields.get('redirect', False),
+                          [fields.get('text', '')]))
+        del chars[:]
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = chars.append
+
+    if hasattr(text, 'read'):
+        chunks = iter(lambda: text.read(chunk_size), '')
+    else:
+        chunks = iter(text)
+    first = next(chunks, '')
+    head = first.lstrip()
+    if not head.startswith('<mediawiki') and not head.startswith('<?xml'):
+        # a portion of a dump: supply the root element
+        parser.Parse('<mediawiki>')
+    parser.Parse(first)
+    for chunk in chunks:
+        yield from pages
+        del pages[:]
+        parser.Parse(chunk)
+    if path:
+        # the root element is not closed in a portion of a dump
+        parser.Parse('</%s>' % path[0])
+    parser.Parse('', True)
+    yield from pages
+
+
+##
+# Available page readers, selected with --reader
+pageReaders = {
+    'regex': read_pages,
+    'expat': read_pages_expat
+}
+
+
+def collect_pages(text, reader='regex'):
+    """
+    :param text: the text of a wikipedia file dump.
+    :param reader: the name of the page reader to use, see pageReaders.
+    :return: an iterator on tuples (id, revid, title, page) of the articles
+        to extract.
+    """
+    last_id = ''
+    for id, revid, title, redirect, page in pageReaders[reader](text):
+        colon = title.find(':')
+        if (colon < 0 or (title[:colon] in acceptedNamespaces) and id != last_id and
+                not redirect and not title.startswith(templateNamespace)):
+            yield (id, revid, title, page)
+            last_id = id
+
+
+# ----------------------------------------------------------------------
+# Incremental extraction
+
+
+class RevisionIndex():
+
+    """
+    Compact map from page ids to revision ids, as sorted arrays searched by
+    bisection, saved by an extraction so that the next one can skip the pages
+    whose revision has not changed.
+    """
+
+    magic = b'WXRI'
+
+    def __init__(self):
+        self.ids = array('q')
+        self.revids = array('q')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, id, revid):
+        """Append a page, keeping the index unsorted until sort()."""
+        self.ids.append(id)
+        self.revids.append(revid)
+
+    def sort(self):
+        if any(a > b for a, b in zip(self.ids, islice(self.ids, 1, None))):
+            pairs = sorted(zip(self.ids, self.revids))
+            self.ids = array('q', (id for id, _ in pairs))
+            self.revids = array('q', (revid for _, revid in pairs))
+
+    def get(self, id):
+        """
+        :return: the revision of page :param id:, or None if absent.
+        """
+        i = bisect_left(self.ids, id)
+        if i < len(self.ids) and self.ids[i] == id:
+            return self.revids[i]
+        return None
+
+    def update(self, other):
+        """
+        :return: a new index with the pages of both, with the revisions in
+            :param other: taking precedence.
+        """
+        merged = RevisionIndex()
+        i = j = 0
+        while i < len(self.ids) or j < len(other.ids):
+            if j == len(other.ids) or (i < len(self.ids) and self.ids[i] < other.ids[j]):
+                merged.add(self.ids[i], self.revids[i])
+                i += 1
+            else:
+                if i < len(self.ids) and self.ids[i] == other.ids[j]:
+                    i += 1
+                merged.add(other.ids[j], other.revids[j])
+                j += 1
+        return merged
+
+    def missing(self, other):
+        """
+        :return: the ids of the pages in this index not in :param other:.
+        """
+        return [id for id in self.ids if other.get(id) is None]
+
+    @classmethod
+    def load(cls, filename):
+        index = cls()
+        with open(filename, 'rb') as file:
+            if file.read(len(cls.magic)) != cls.magic:
+                raise ValueError("%s is not a revision index" % filename)
+            count = int.from_bytes(file.read(8), 'little')
+            index.ids.fromfile(file, count)
+            index.revids.fromfile(file, count)
+        return index
+
+    def save(self, filename):
+        temp = filename + '.tmp'
+        with open(temp, 'wb') as file:
+            file.write(self.magic)
+            file.write(len(self.ids).to_bytes(8, 'little'))
+            self.ids.tofile(file)
+            self.revids.tofile(file)
+        os.replace(temp, filename)
+
+
+def changed_pages(pages, previous, seen):
+    """
+    :param pages: iterator on tuples (id, revid, title, page).
+    :param previous: RevisionIndex of the previous extraction.
+    :param seen: RevisionIndex where to add all pages.
+    :return: an iterator on the pages whose revision is not in previous.
+    """
+    for page in pages:
+        id = int(page[0])
+        revid = int(page[1] or 0)
+        seen.add(id, revid)
+        if previous.get(id) != revid:
+            yield page
+
+
+def tombstone(id):
+    """
+    :return: the output recording that page :param id: was deleted.
+    """
+    if Extractor.to_json:
+        return json.dumps({'id': str(id), 'deleted': True}) + '\n'
+    return '<doc id="%s" deleted="true">\n</doc>\n' % id
+
+
+def error_record(id, urlbase, title, error):
+    """
+    :return: the output recording that page :param id: could not be
+        extracted, because of :param error:.
+    """
+    url = get_url(urlbase, id)
+    if Extractor.to_json:
+        return json.dumps({'id': id, 'url': url, 'title': title, 'error': error}) + '\n'
+    return '<doc id="%s" url="%s" title="%s" error="%s">\n</doc>\n' % (id, url, title, error)
+
+
 def process_dump(input_file, template_file, out_file, file_size, file_compress,
-                 process_count, html_safe, expand_templates=True):
+                 process_count, html_safe, expand_templates=True, index_file=None,
+                 reader='regex', templates_db=None, preload_count=0,
+                 batch_size=1, batch_bytes=0, ordered=True, buffer_limit=0,
+                 shared_buffer=0, checkpointing=False, resume=False, revisions=None,
+                 adds_changes=False,
+                 profile_file=None, profile_top=20, metrics_file=None, metrics_port=None,
+                 metrics_interval=10, worker_articles=0, worker_memory=0, worker_timeout=0,
+                 sharded=False, doc_index=False, decompressor='auto', split=False):
     """
     :param input_file: name of the wikipedia dump file; '-' to read from stdin
     :param template_file: optional file with template definitions.
     :param out_file: directory where to store extracted data, or '-' for stdout
     :param file_size: max size of each extracted file, or None for no max (one file)
-    :param file_compress: whether to compress files with bzip.
+    :param file_compress: the Compressor of output files, None not to
+        compress them; extract processes compress the text of each job.
     :param process_count: number of extraction processes to spawn.
     :html_safe: whether to convert entities in text to HTML.
     :param expand_templates: whether to expand templates.
+    :param index_file: index of a multistream dump: when given, each worker
+        decompresses and parses its own blocks of the dump.
+    :param reader: the name of the page reader to use, see pageReaders.
+    :param templates_db: optional database of parsed templates, used in place
+        of template_file, or created if it does not exist.
+    :param preload_count: number of templates to parse before spawning
+        processes, so that they share them.
+    :param batch_size: maximum number of articles dispatched together to an
+        extract process.
+    :param batch_bytes: maximum size of the text of the articles dispatched
+        together, 0 for no limit.
+    :param ordered: whether to output articles in the order of the dump.
+    :param buffer_limit: size of the text waiting to be written in order
+        above which the mapper stops dispatching jobs, 0 for no limit.
+    :param shared_buffer: size of a buffer in shared memory through which to
+        pass the text of pages to extract processes, 0 to pass it through the
+        jobs queue.
+    :param checkpointing: whether to record the progress of the extraction
+        in a Checkpoint in out_file, so that it can be resumed.
+    :param resume: whether to resume a previous extraction into out_file,
+        which implies :param checkpointing:.
+    :param revisions: file with the RevisionIndex of the previous extraction:
+        only new or changed pages are extracted, and it is updated at the end.
+    :param adds_changes: whether the dump holds only added and changed pages,
+        so that missing pages are not deleted.
+    :param profile_file: file where to write a report of the time spent in
+        each stage of extraction, None not to profile.
+    :param profile_top: number of slowest articles and templates to report.
+    :param metrics_file: file where to write metrics of the progress of the
+        extraction, in the Prometheus text format.
+    :param metrics_port: port where to serve the metrics over HTTP.
+    :param metrics_interval: seconds between writes of metrics_file.
+    :param worker_articles: articles after which an extract process is
+        replaced by a fresh one, 0 for no limit.
+    :param worker_memory: resident memory in bytes above which an extract
+        process is replaced by a fresh one, 0 for no limit.
+    :param worker_timeout: seconds after which an extract process still on
+        an article is killed, and the article replaced by an error record, 0
+        for no limit.
+    :param sharded: whether each extract process writes its own output
+        files, in no particular order, rather than the reduce process.
+    :param doc_index: whether to write an index of the documents in the
+        output files, a DocIndex, to out_file/docs.idx.
+    :param decompressor: the external decompressor through which to read a
+        compressed dump, see find_decompressor().
+    :param split: whether to split an uncompressed dump into blocks of
+        batch_bytes, which each extract process reads and parses by itself.
     """
     global knownNamespaces
     global templateNamespace
@@ -353,7 +1033,45 @@ def process_dump(input_file, template_file, out_file, file_size, file_compress,
 
     urlbase = ''                # This is obtained from <siteinfo>
 
-    input = decode_open(input_file)
+    if index_file and input_file == '-':
+        raise ValueError("a multistream index cannot be used with stdin dump")
+    if index_file and revisions:
+        raise ValueError("incremental extraction cannot be used with a multistream index")
+    if split:
+        if input_file == '-' or os.path.splitext(input_file)[1] in ('.bz2', '.gz'):
+            raise ValueError("only an uncompressed dump file can be split")
+        if index_file:
+            raise ValueError("a multistream dump is already split by its index")
+        if revisions:
+            raise ValueError("incremental extraction cannot be used with a split dump")
+    if sharded:
+        if out_file == '-':
+            raise ValueError("sharded output cannot be written to stdout")
+        ordered = False
+    if doc_index:
+        if out_file == '-':
+            raise ValueError("an index of documents cannot be written for stdout")
+        if resume:
+            raise ValueError("an index of documents cannot be written when resuming")
+
+    checkpoint = None
+    if checkpointing or resume:
+        if out_file == '-' or not ordered:
+            raise ValueError("cannot checkpoint or resume an extraction to stdout or unordered")
+        checkpoint = Checkpoint(out_file, input_file, bool(index_file or split))
+        if resume and checkpoint.load():
+            if checkpoint.finished:
+                logging.info("Extraction into %s already finished.", out_file)
+                return
+            logging.info("Resuming after %d articles.", checkpoint.articles)
+
+    external = find_decompressor(input_file, decompressor)
+    if external:
+        logging.info("Decompressing %s with %s.", input_file, external[0])
+    elif decompressor not in ('auto', 'python'):
+        logging.warning("%s cannot decompress %s or is not installed, using Python modules.",
+                        decompressor, input_file)
+    input = decode_open(input_file, decompressor=decompressor)
 
     # collect siteinfo
     for line in input:
@@ -381,28 +1099,46 @@ def process_dump(input_file, template_file, out_file, file_size, file_compress,
     if expand_templates:
         # preprocess
         template_load_start = default_timer()
-        if template_file and os.path.exists(template_file):
+        if templates_db and os.path.exists(templates_db):
+            logging.info("Using template database '%s'.", templates_db)
+            templates = len(use_template_db(templates_db))
+        elif template_file and os.path.exists(template_file):
             logging.info("Preprocessing '%s' to collect template definitions: this may take some time.", template_file)
-            file = decode_open(template_file)
-            templates = load_templates(file)
+            file = decode_open(template_file, decompressor=decompressor)
+            templates = load_templates(file, reader=reader)
             file.close()
         else:
             if input_file == '-':
                 # can't scan then reset stdin; must error w/ suggestion to specify template_file
                 raise ValueError("to use templates with stdin dump, must supply explicit template-file")
             logging.info("Preprocessing '%s' to collect template definitions: this may take some time.", input_file)
-            templates = load_templates(input, template_file)
+            templates = load_templates(input, template_file, reader)
             input.close()
-            input = decode_open(input_file)
+            input = decode_open(input_file, decompressor=decompressor)
+        if templates_db and not os.path.exists(templates_db):
+            logging.info("Saving parsed templates to database '%s'.", templates_db)
+            save_template_db(templates_db)
+            use_template_db(templates_db)
         template_load_elapsed = default_timer() - template_load_start
         logging.info("Loaded %d templates in %.1fs", templates, template_load_elapsed)
+        if preload_count:
+            preloaded = preload_templates(preload_count)
+            logging.info("Preloaded %d templates.", preloaded)
+            if hasattr(gc, 'freeze'):
+                # keep the collector from touching, hence copying, shared objects
+                gc.freeze()
 
     if out_file == '-':
         output = sys.stdout
         if file_compress:
             logging.warn("writing to stdout, so no output compression (use an external tool)")
-    else:
+            file_compress = None
+    elif not sharded:
         nextFile = NextFile(out_file)
+        if resume and checkpoint:
+            # continue after the last complete file
+            nextFile.dir_index = checkpoint.dir_index
+            nextFile.file_index = checkpoint.file_index
         output = OutputSplitter(nextFile, file_size, file_compress)
 
     # process pages
@@ -414,113 +1150,1200 @@ def process_dump(input_file, template_file, out_file, file_size, file_compress,
     # - a reduce process collects the results, sort them and print them.
 
     # fixes MacOS error: TypeError: cannot pickle '_io.TextIOWrapper' object
-    Process = get_context("fork").Process
+    context = get_context("fork")
+    Process = context.Process
 
     maxsize = 10 * process_count
+    supervised = worker_articles or worker_memory or worker_timeout
     # output queue
-    output_queue = Queue(maxsize=maxsize)
-
-    # Reduce job that sorts and prints output
-    reduce = Process(target=reduce_process, args=(output_queue, output))
-    reduce.start()
+    if supervised:
+        # written to without a feeder thread, so that extract processes can
+        # be killed without losing their output
+        output_queue = context.SimpleQueue()
+        done_queue = context.SimpleQueue()
+    else:
+        output_queue = Queue(maxsize=maxsize)
+        done_queue = None
+
+    # limit on text held back by the reduce process, to stop the mapper when
+    # a slow article holds back the output of all the others
+    limit = BufferLimit(context, buffer_limit) if ordered and buffer_limit else None
+
+    if profile_file:
+        # inherited by extract processes, which send their own to the reducer
+        Extractor.profile = Profile(profile_top)
+
+    # counters shared by all processes
+    workers_count = max(1, process_count)
+    metrics = Metrics(context, workers_count) if metrics_file or metrics_port else None
+
+    shards = None
+    if sharded:
+        # a series of files for each extract process, and one for this
+        shards = ShardedOutput(context, out_file, workers_count + 1, file_size, file_compress,
+                               doc_index)
+        index_parts = shards.index_parts
+        reduce = None
+    else:
+        index_part = None
+        index_parts = []
+        if doc_index:
+            index_part = DocIndexPart(os.path.join(out_file, 'docs'))
+            index_part.clear()
+            index_parts = [index_part]
+        # Reduce job that sorts and prints output
+        reduce = Process(target=reduce_process, args=(output_queue, output, ordered, limit, checkpoint,
+                                                      Extractor.profile, profile_file, metrics, done_queue,
+                                                      index_part))
+        reduce.start()
 
     # initialize jobs queue
     jobs_queue = Queue(maxsize=maxsize)
 
+    ring = None
+    if shared_buffer and not (index_file or split):
+        if shared_memory:
+            ring = PageRing(context, shared_buffer, 4 * maxsize)
+        else:
+            logging.warning("shared memory not available, ignoring --shared-buffer")
+
     # start worker processes
     logging.info("Using %d extract processes.", process_count)
+    # with no file size, each article goes to a file of its own
+    per_article = file_size == 0 and out_file != '-'
+    if index_file or split:
+        # workers read the dump by themselves
+        target = extract_block_process
+        args = (input_file, jobs_queue, output_queue, html_safe, reader, file_compress, shards,
+                doc_index, per_article)
+    else:
+        target = extract_process
+        args = (jobs_queue, output_queue, html_safe, ring, file_compress, shards, doc_index,
+                per_article)
     workers = []
-    for _ in range(max(1, process_count)):
-        extractor = Process(target=extract_process,
-                            args=(jobs_queue, output_queue, html_safe))
-        extractor.daemon = True  # only live while parent process lives
-        extractor.start()
-        workers.append(extractor)
-
-    # Mapper process
-
-    # we collect individual lines, since str.join() is significantly faster
-    # than concatenation
+    supervisor = None
+    if supervised:
+        supervisor = Supervisor(context, workers_count, target, args + (metrics,), jobs_queue,
+                                done_queue, worker_articles, worker_memory, worker_timeout, ring)
+        supervisor.start()
+        idle = supervisor.poll
+    else:
+        idle = None
+        for i in range(workers_count):
+            extractor = Process(target=target, args=args + (metrics, i))
+            extractor.daemon = True  # only live while parent process lives
+            extractor.start()
+            workers.append(extractor)
+    if sharded and profile_file:
+        # not into Extractor.profile, inherited by processes started later
+        profile = Profile(profile_top)
+        reduce = threading.Thread(target=merge_profiles, args=(output_queue, profile))
+        reduce.start()
+
+    def dispatch(ordinal, job):
+        if supervisor:
+            supervisor.dispatch(ordinal, job)
+        else:
+            jobs_queue.put(job)
 
-    ordinal = 0  # page count
-    for id, revid, title, page in collect_pages(input):
-        job = (id, revid, urlbase, title, page, ordinal)
-        jobs_queue.put(job)  # goes to any available extract_process
-        ordinal += 1
+    if metrics:
+        metrics.queues = {'jobs': jobs_queue}
+        if not supervised:      # a SimpleQueue has no length
+            metrics.queues['output'] = output_queue
+        metrics.report(metrics_file, metrics_port, metrics_interval)
 
-    input.close()
+    # Mapper process
 
+    ordinal = 0  # batch count, or block count with index_file or split
+    articles = 0
+    if index_file or split:
+        input.close()
+        if index_file:
+            logging.info("Reading multistream index '%s'.", index_file)
+            offsets = read_multistream_index(index_file)
+            # the first stream holds the <siteinfo>
+        else:
+            # blocks of the size of batches, or enough to keep processes busy
+            size = batch_bytes or max(1, os.path.getsize(input_file) // maxsize)
+            offsets = split_dump(input_file, size)
+            logging.info("Split '%s' into %d blocks.", input_file, len(offsets))
+        blocks = list(zip(offsets, offsets[1:] + [None]))
+        if checkpoint and checkpoint.blocks:
+            logging.info("Skipping %d blocks already extracted.", checkpoint.blocks)
+            blocks = blocks[checkpoint.blocks:]
+        for start, end in blocks:
+            if limit:
+                limit.wait(idle)
+            job = (urlbase, start, end, ordinal, {})
+            dispatch(ordinal, job)  # goes to any available extract_block_process
+            ordinal += 1
+            if metrics:
+                metrics.jobs.value += 1
+    else:
+        # Articles are dispatched in batches, to reduce the overhead of
+        # pickling and queueing them, both to and from extract processes.
+        batch = []
+        batch_length = 0  # characters in batch
+        put_time = 0.0  # time spent waiting for room in jobs_queue
+        hold_time = 0.0  # time spent waiting for the reduce process
+        # we collect individual lines, since str.join() is significantly faster
+        # than concatenation
+        pages = collect_pages(input, reader)
+        raw = raw_file(input)
+        if revisions:
+            if os.path.exists(revisions):
+                previous = RevisionIndex.load(revisions)
+                logging.info("Loaded revisions of %d pages from '%s'.", len(previous), revisions)
+            else:
+                previous = RevisionIndex()
+            seen = RevisionIndex()
+            pages = changed_pages(pages, previous, seen)
+        if checkpoint and checkpoint.articles:
+            logging.info("Skipping %d articles already extracted.", checkpoint.articles)
+            for _ in islice(pages, checkpoint.articles):
+                pass
+        for page in pages:
+            batch.append(page)
+            if batch_bytes:
+                batch_length += sum(len(line) for line in page[3])
+            if len(batch) >= batch_size or (batch_bytes and batch_length >= batch_bytes):
+                if limit:
+                    hold_time += limit.wait(idle)
+                put_start = default_timer()
+                job = make_job(urlbase, batch, ordinal, ring, idle)
+                dispatch(ordinal, job)  # goes to any available extract_process
+                put_time += default_timer() - put_start
+                if metrics:
+                    metrics.dispatched(batch, raw)
+                ordinal += 1
+                articles += len(batch)
+                batch = []
+                batch_length = 0
+        if batch:
+            job = make_job(urlbase, batch, ordinal, ring, idle)
+            dispatch(ordinal, job)
+            if metrics:
+                metrics.dispatched(batch, raw)
+            ordinal += 1
+            articles += len(batch)
+
+        input.close()
+        if ordinal:
+            logging.info("Dispatched %d articles in %d batches (%.1f articles per batch), waiting %.1fs for workers",
+                         articles, ordinal, articles / ordinal, put_time)
+        if ring:
+            logging.info("Passed %d batches through shared memory, waiting %.1fs for room",
+                         ring.batches, ring.wait_time)
+        if hold_time:
+            logging.info("Waited %.1fs for the reorder buffer to drain", hold_time)
+
+    if supervisor:
+        supervisor.stop()
     # signal termination
     for _ in workers:
         jobs_queue.put(None)
     # wait for workers to terminate
     for w in workers:
         w.join()
+    if ring:
+        ring.close()
+
+    if revisions:
+        seen.sort()
+        if adds_changes:
+            current = previous.update(seen)
+        else:
+            current = seen
+            deleted = previous.missing(seen)
+            if deleted:
+                text = ''.join(tombstone(id) for id in deleted)
+                if file_compress:
+                    text = file_compress(text)
+                if shards:
+                    shards.write(workers_count, text, len(deleted))
+                    shards.close(workers_count)
+                else:
+                    output_queue.put((ordinal, text, 0, None))
+                ordinal += 1
+            logging.info("Marked %d pages as deleted.", len(deleted))
+        skipped = len(seen) - articles - (checkpoint.articles if checkpoint else 0)
+        logging.info("Skipped %d unchanged pages out of %d.", skipped, len(seen))
 
     # signal end of work to reduce process
     output_queue.put(None)
     # wait for it to finish
-    reduce.join()
+    if reduce:
+        reduce.join()
+    if shards:
+        if profile_file:
+            with open(profile_file, 'w') as file:
+                profile.report(file)
+            logging.info("Wrote profile of %d articles to %s", profile.articles, profile_file)
+        files, docs = shards.write_manifest()
+        logging.info("Wrote %d documents in %d files, listed in %s", docs, files,
+                     os.path.join(out_file, ShardedOutput.manifest))
+    if doc_index:
+        doc_index_file = os.path.join(out_file, 'docs.idx')
+        indexed = write_doc_index(doc_index_file, index_parts)
+        logging.info("Indexed %d documents in %s", indexed, doc_index_file)
+    if metrics:
+        metrics.close(metrics_file)
+
+    if revisions:
+        current.save(revisions)
 
-    if output != sys.stdout:
-        output.close()
     extract_duration = default_timer() - extract_start
-    extract_rate = ordinal / extract_duration
-    logging.info("Finished %d-process extraction of %d articles in %.1fs (%.1f art/s)",
-                 process_count, ordinal, extract_duration, extract_rate)
+    if index_file or split:
+        logging.info("Finished %d-process extraction of %d blocks in %.1fs",
+                     process_count, ordinal, extract_duration)
+    else:
+        extract_rate = articles / extract_duration
+        logging.info("Finished %d-process extraction of %d articles in %.1fs (%.1f art/s)",
+                     process_count, articles, extract_duration, extract_rate)
 
 
 # ----------------------------------------------------------------------
 # Multiprocess support
 
 
-def extract_process(jobs_queue, output_queue, html_safe):
-    """Pull tuples of raw page content, do CPU/regex-heavy fixup, push finished text
+def make_job(urlbase, batch, ordinal, ring=None, idle=None):
+    """
+    :param batch: list of (id, revid, title, page).
+    :param ring: a PageRing where to put the text of the pages, if possible.
+    :param idle: function called every so often while waiting for room in
+        :param ring:.
+    :return: the job for an extract_process, with no articles to skip.
+    """
+    region = ring.put([page for _, _, _, page in batch], idle) if ring else None
+    if region:
+        batch = [(id, revid, title, None) for id, revid, title, _ in batch]
+    return (urlbase, batch, ordinal, region, {})
+
+
+def job_output(text, docs, compress=None, doc_index=False, per_article=False):
+    """
+    :param text: the text extracted by a job.
+    :param docs: list of (id, start, length, title) of its articles, with
+        start and length in characters, or None.
+    :param compress: the Compressor of the output, if any.
+    :param doc_index: whether to report the byte spans of the documents.
+    :param per_article: whether to output the text of each article apart.
+    :return: (data, spans): the text, compressed if required, and the byte
+        spans of its documents, or None; with :param per_article:, lists of
+        them, for each article with some text.
+    """
+    if per_article:
+        pieces = []
+        spans = []
+        for id, start, length, title in docs:
+            if length:
+                piece = text[start:start + length]
+                spans.append(byte_spans(piece, [(id, 0, length, title)]) if doc_index else None)
+                pieces.append(compress(piece) if compress else piece)
+        return pieces, spans
+    spans = byte_spans(text, docs) if doc_index else None
+    return (compress(text) if compress else text), spans
+
+
+def extract_process(jobs_queue, output_queue, html_safe, ring=None, compress=None, shards=None,
+                    doc_index=False, per_article=False, metrics=None, worker=0, supervisor=None):
+    """Pull batches of raw page content, do CPU/regex-heavy fixup, push finished text
     :param jobs_queue: where to get jobs.
     :param output_queue: where to queue extracted text for output.
     :html_safe: whether to convert entities in text to HTML.
+    :param ring: the PageRing holding the text of pages, when the region of a
+        job is not None.
+    :param compress: the Compressor of the text of each job, if any.
+    :param shards: the ShardedOutput where to write the text of each job, in
+        series :param worker:, rather than queueing it.
+    :param doc_index: whether to report the span of each document in the
+        text, to index them.
+    :param per_article: whether to output the text of each article apart,
+        to write it to a file of its own.
+    :param metrics: the Metrics where to count jobs, in slot :param worker:.
+    :param supervisor: the Supervisor of this process, in slot :param worker:,
+        if any.
     """
+    extracted = 0
     while True:
-        job = jobs_queue.get()  # job is (id, revid, urlbase, title, page)
+        job = jobs_queue.get()  # job is (urlbase, [(id, revid, title, page)], ordinal, region, skip)
         if job:
+            job_start = default_timer()
+            urlbase, pages, ordinal, region, skip = job
+            if region:
+                # the supervisor releases the region once the job is received
+                pages = ring.get(pages, region, not supervisor)
+            if supervisor:
+                supervisor.begin(worker, ordinal)
             out = StringIO()  # memory buffer
-            Extractor(*job[:-1]).extract(out, html_safe)  # (id, urlbase, title, page)
-            text = out.getvalue()
-            output_queue.put((job[-1], text))  # (ordinal, extracted_text)
+            over_budget = 0
+            docs = [] if doc_index or per_article else None
+            for i, (id, revid, title, page) in enumerate(pages):
+                if supervisor:
+                    supervisor.article(worker, i)
+                start = out.tell()
+                if i in skip:
+                    out.write(error_record(id, urlbase, title, skip[i]))
+                else:
+                    extractor = Extractor(id, revid, urlbase, title, page)
+                    extractor.extract(out, html_safe)
+                    over_budget += extractor.exhausted
+                if docs is not None:
+                    docs.append((id, start, out.tell() - start, title))
+            if supervisor:
+                supervisor.article(worker, Supervisor.writing)
+            text, docs = job_output(out.getvalue(), docs, compress, doc_index, per_article)
+            if metrics:
+                metrics.extracted_job(worker, len(pages), default_timer() - job_start, over_budget)
+            if shards:
+                shards.write(worker, text, len(pages), docs)
+                if supervisor:
+                    supervisor.articles[worker] = Supervisor.written
+                    supervisor.end(worker, ordinal)
+            else:
+                output_queue.put((ordinal, text, len(pages), docs))  # (ordinal, extracted_text, articles, spans)
+                if supervisor:
+                    supervisor.end(worker)
             out.close()
+            extracted += len(pages)
+            if supervisor and supervisor.exhausted(worker, extracted):
+                break
         else:
             break
+    if shards:
+        shards.close(worker)
+    if Extractor.profile:
+        output_queue.put(Extractor.profile)
+    logging.info("Template cache: %s", templateCache)
+    if expansionCache.maxsize:
+        logging.info("Expansion cache: %s", expansionCache)
+
+
+def extract_block_process(input_file, jobs_queue, output_queue, html_safe, reader,
+                          compress=None, shards=None, doc_index=False, per_article=False,
+                          metrics=None, worker=0, supervisor=None):
+    """Pull byte ranges of a multistream dump, decompress them and extract the
+    pages they contain, push the finished text of the whole block.
+    :param input_file: name of the multistream dump file, or of an
+        uncompressed dump, split by split_dump().
+    :param jobs_queue: where to get jobs.
+    :param output_queue: where to queue extracted text for output.
+    :html_safe: whether to convert entities in text to HTML.
+    :param reader: the name of the page reader to use, see pageReaders.
+    :param compress: the Compressor of the text of each job, if any.
+    :param shards: the ShardedOutput where to write the text of each job, in
+        series :param worker:, rather than queueing it.
+    :param doc_index: whether to report the span of each document in the
+        text, to index them.
+    :param per_article: whether to output the text of each article apart,
+        to write it to a file of its own.
+    :param metrics: the Metrics where to count jobs, in slot :param worker:.
+    :param supervisor: the Supervisor of this process, in slot :param worker:,
+        if any.
+    """
+    extracted = 0
+    decompress = os.path.splitext(input_file)[1] == '.bz2'
+    with open(input_file, 'rb') as input:
+        while True:
+            job = jobs_queue.get()  # job is (urlbase, start, end, ordinal, skip)
+            if job:
+                job_start = default_timer()
+                urlbase, start, end, ordinal, skip = job
+                if supervisor:
+                    supervisor.begin(worker, ordinal)
+                block = read_block(input, start, end, decompress)
+                if metrics:
+                    metrics.block_bytes[worker] += input.tell() - start
+                    metrics.block_chars[worker] += len(block)
+                out = StringIO()  # memory buffer
+                articles = 0
+                over_budget = 0
+                docs = [] if doc_index or per_article else None
+                for id, revid, title, page in collect_pages(StringIO(block), reader):
+                    if supervisor:
+                        supervisor.article(worker, articles)
+                    start = out.tell()
+                    if articles in skip:
+                        out.write(error_record(id, urlbase, title, skip[articles]))
+                    else:
+                        extractor = Extractor(id, revid, urlbase, title, page)
+                        extractor.extract(out, html_safe)
+                        over_budget += extractor.exhausted
+                    articles += 1
+                    if docs is not None:
+                        docs.append((id, start, out.tell() - start, title))
+                if supervisor:
+                    supervisor.article(worker, Supervisor.writing)
+                text, docs = job_output(out.getvalue(), docs, compress, doc_index, per_article)
+                if metrics:
+                    metrics.extracted_job(worker, articles, default_timer() - job_start, over_budget)
+                if shards:
+                    shards.write(worker, text, articles, docs)
+                    if supervisor:
+                        supervisor.articles[worker] = Supervisor.written
+                        supervisor.end(worker, ordinal)
+                else:
+                    output_queue.put((ordinal, text, articles, docs))
+                    if supervisor:
+                        supervisor.end(worker)
+                out.close()
+                extracted += articles
+                if supervisor and supervisor.exhausted(worker, extracted):
+                    break
+            else:
+                break
+    if shards:
+        shards.close(worker)
+    if Extractor.profile:
+        output_queue.put(Extractor.profile)
+    logging.info("Template cache: %s", templateCache)
+    if expansionCache.maxsize:
+        logging.info("Expansion cache: %s", expansionCache)
+
+
+class BufferLimit():
+    """
+    Limit on the size of the text held by the reduce process waiting to be
+    written in order, which is shared with the mapper: the mapper stops
+    dispatching jobs while the reduce process holds more than the limit.
+    """
+
+    def __init__(self, context, limit):
+        """
+        :param context: the multiprocessing context of the processes.
+        :param limit: the maximum size of the buffered text, 0 for no limit.
+        """
+        self.limit = limit
+        self.size = context.Value('q', 0, lock=False)
+        self.condition = context.Condition()
 
+    def update(self, size):
+        """
+        Record the current :param size: of buffered text (reduce process).
+        """
+        over = self.size.value > self.limit
+        self.size.value = size
+        if over and size <= self.limit:
+            with self.condition:
+                self.condition.notify_all()
 
-def reduce_process(output_queue, output):
+    def wait(self, idle=None):
+        """
+        Wait while the buffered text exceeds the limit (mapper).
+        :param idle: function called every so often while waiting.
+        :return: the time waited.
+        """
+        if not self.limit or self.size.value <= self.limit:
+            return 0.0
+        start = default_timer()
+        while self.size.value > self.limit:
+            with self.condition:
+                # the timeout covers a notification missed since the check
+                if self.size.value > self.limit:
+                    self.condition.wait(Supervisor.interval if idle else 1.0)
+            if idle:
+                idle()
+        return default_timer() - start
+
+
+class PageRing():
+    """
+    Ring buffer in shared memory, where the mapper copies the UTF-8 text of
+    the pages of a batch, so that only their offsets go through the jobs queue
+    and extract processes decode the text straight from shared memory.
+    Space is reclaimed in the order in which it was allocated, as extract
+    processes release the batches they have read.
+    """
+
+    def __init__(self, context, size, slots):
+        """
+        :param context: the multiprocessing context of the processes.
+        :param size: the size of the buffer in bytes.
+        :param slots: maximum number of batches in the buffer at once.
+        """
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self.size = size
+        self.released = context.RawArray('b', slots)  # flags, by slot
+        # mapper side
+        self.pending = deque()  # (slot, end) of the batches in the buffer
+        self.slot = 0  # next slot
+        self.head = 0  # where to write next, always increasing
+        self.tail = 0  # start of space in use
+        self.batches = 0
+        self.wait_time = 0.0
+
+    def reclaim(self):
+        while self.pending and self.released[self.pending[0][0]]:
+            slot, self.tail = self.pending.popleft()
+            self.released[slot] = 0
+
+    def put(self, pages, idle=None):
+        """
+        Copy the text of pages into the buffer, waiting for room if needed.
+        :param pages: list of page texts, each a list of lines.
+        :param idle: function called every so often while waiting.
+        :return: (slot, offset, sizes) of the text in the buffer, or None if
+            it is too large for the buffer.
+        """
+        data = [''.join(page).encode('utf-8') for page in pages]
+        total = sum(len(d) for d in data)
+        if total > self.size // 2:
+            return None
+        offset = self.head % self.size
+        start = self.head
+        if offset + total > self.size:
+            start += self.size - offset  # text is not split at the end
+            offset = 0
+        self.reclaim()
+        if start + total - self.tail > self.size or len(self.pending) == len(self.released):
+            wait_start = default_timer()
+            while True:
+                time.sleep(0.001)
+                if idle:
+                    idle()
+                self.reclaim()
+                if start + total - self.tail <= self.size and len(self.pending) < len(self.released):
+                    break
+            self.wait_time += default_timer() - wait_start
+        position = offset
+        for d in data:
+            self.memory.buf[position:position + len(d)] = d
+            position += len(d)
+        self.head = start + total
+        slot = self.slot
+        self.slot = (slot + 1) % len(self.released)
+        self.pending.append((slot, self.head))
+        self.batches += 1
+        return slot, offset, [len(d) for d in data]
+
+    def get(self, pages, region, release=True):
+        """
+        Read the text of pages from the buffer and release their space
+        (extract process).
+        :param pages: list of (id, revid, title, None).
+        :param region: the (slot, offset, sizes) returned by put().
+        :param release: whether to release their space, else see release().
+        :return: list of (id, revid, title, page).
+        """
+        slot, offset, sizes = region
+        buf = self.memory.buf
+        texts = []
+        for (id, revid, title, _), size in zip(pages, sizes):
+            texts.append((id, revid, title, [str(buf[offset:offset + size], 'utf-8')]))
+            offset += size
+        if release:
+            self.released[slot] = 1
+        return texts
+
+    def release(self, region):
+        """
+        Release the space of :param region:, once its text is no longer
+        needed, e.g. to dispatch its job again.
+        """
+        self.released[region[0]] = 1
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def resident_memory():
+    """
+    :return: the resident memory of this process in bytes, or its peak where
+        the current one is not available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        if not resource:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # KB on Linux
+
+
+class Supervisor():
+    """
+    Keeps the pool of extract processes healthy: a process exits after
+    extracting max_articles articles, or once its memory grows beyond
+    max_memory, and is replaced by a fresh one forked from the main process;
+    a process stuck on an article for more than timeout seconds, e.g. in a
+    pathological regular expression, is killed and replaced, and its job is
+    dispatched again with an error record in place of the article it was
+    stuck on, so that the reduce process never waits for it forever.
+    The same holds for a process that dies on a job; a process that dies
+    while sending or writing the output of a job has its job dispatched again
+    as it was, unless it was done writing it, and the reduce process drops
+    the output of a job if it receives it twice.
+    Processes are only killed while extracting, when they hold no lock and
+    have sent all their output, provided that the output queue is a
+    SimpleQueue, which has no feeder thread.
+    Processes are checked by the main process, in the mapper, whenever it
+    dispatches a job or waits, through poll(), so that they are forked from
+    the thread that forked the first ones, and not from a thread of their
+    own while the mapper runs.
+    """
+
+    interval = 0.5              # seconds between checks
+
+    # states of an extract process past the articles of its job
+    writing = -1                # compressing and sending or writing its output
+    written = -2                # done writing it by itself
+
+    def __init__(self, context, count, target, args, jobs_queue, done_queue,
+                 max_articles=0, max_memory=0, timeout=0, ring=None):
+        """
+        :param context: the multiprocessing context.
+        :param count: number of extract processes.
+        :param target: the function run by extract processes.
+        :param args: its arguments, followed by the slot of the process and
+            this supervisor.
+        :param jobs_queue: the queue of jobs of extract processes.
+        :param done_queue: where the reduce process, or extract processes
+            writing their own output, put the ordinals of the jobs done.
+        :param max_articles: articles after which an extract process is
+            replaced, 0 for no limit.
+        :param max_memory: resident memory in bytes above which an extract
+            process is replaced, 0 for no limit.
+        :param timeout: seconds after which an extract process still on an
+            article is killed, 0 for no limit.
+        :param ring: the PageRing holding the text of jobs, whose regions
+            are released once their jobs are received, rather than read, so
+            that they can be dispatched again.
+        """
+        self.context = context
+        self.target = target
+        self.args = args
+        self.jobs_queue = jobs_queue
+        self.done_queue = done_queue
+        self.max_articles = max_articles
+        self.max_memory = max_memory
+        self.timeout = timeout
+        self.ring = ring
+        # updated by each extract process
+        self.ordinals = context.RawArray('q', [-1] * count)  # of the job in progress, or -1
+        self.started = context.RawArray('d', count)  # time when it began the article
+        self.articles = context.RawArray('q', count)  # index of the article in progress, or state
+        self.busy = context.Lock()  # held to end a job, or to kill a process on one
+        # main process side
+        self.processes = [None] * count
+        self.pending = {}       # jobs dispatched and not yet received, by ordinal
+        self.checked = 0.0      # time of the last check
+        self.recycled = 0
+        self.killed = 0
+        self.crashed = 0
+
+    def spawn(self, worker):
+        process = self.context.Process(target=self.target, args=self.args + (worker, self))
+        process.daemon = True   # only live while parent process lives
+        process.start()
+        self.processes[worker] = process
+
+    def start(self):
+        """
+        Start the extract processes.
+        """
+        for worker in range(len(self.processes)):
+            self.spawn(worker)
+        self.checked = time.time()
+
+    def dispatch(self, ordinal, job):
+        """
+        Put :param job: in the jobs queue, keeping it until the reduce
+        process receives it, to dispatch it again if needed.
+        """
+        self.pending[ordinal] = job
+        while True:
+            try:
+                self.jobs_queue.put(job, timeout=self.interval)
+                break
+            except queue.Full:
+                self.poll()
+        self.poll()
+
+    def stop(self):
+        """
+        Wait until the reduce process received all the jobs dispatched, then
+        stop the extract processes.
+        """
+        while self.pending:
+            time.sleep(0.1)
+            self.poll()
+        for _ in self.processes:
+            self.jobs_queue.put(None)
+        for process in self.processes:
+            process.join()
+        if self.recycled or self.killed or self.crashed:
+            logging.info("Replaced extract processes: %d recycled, %d killed, %d crashed",
+                         self.recycled, self.killed, self.crashed)
+
+    # extract process side
+
+    def begin(self, worker, ordinal):
+        self.article(worker, 0)
+        self.ordinals[worker] = ordinal
+
+    def article(self, worker, article):
+        """
+        Record that extract process :param worker: is starting :param article:
+        of its job, or is in state writing or written, which are not timed.
+        """
+        self.started[worker] = time.time()
+        self.articles[worker] = article
+
+    def end(self, worker, ordinal=None):
+        """
+        End the job of extract process :param worker:.
+        :param ordinal: the ordinal of the job, when the process wrote its
+            output by itself, to report it done.
+        """
+        with self.busy:
+            if ordinal is not None:
+                self.done_queue.put(ordinal)
+            self.ordinals[worker] = -1
+
+    def exhausted(self, worker, extracted):
+        """
+        :return: whether extract process :param worker: must exit, to be
+            replaced, after extracting :param extracted: articles.
+        """
+        if self.max_articles and extracted >= self.max_articles:
+            logging.debug("Recycling extract process %d after %d articles", worker, extracted)
+            return True
+        if self.max_memory:
+            memory = resident_memory()
+            if memory > self.max_memory:
+                logging.debug("Recycling extract process %d at %.1f MB", worker, memory / 1024 ** 2)
+                return True
+        return False
+
+    # main process side
+
+    def poll(self):
+        """
+        Check the extract processes, if the last check is older than interval.
+        """
+        now = time.time()
+        if now - self.checked >= self.interval:
+            self.check()
+            self.checked = time.time()
+
+    def check(self):
+        """
+        Replace the extract processes which exited or are stuck on an
+        article.
+        """
+        self.received()
+        retries = []
+        for worker, process in enumerate(self.processes):
+            with self.busy:
+                ordinal = self.ordinals[worker]
+                article = self.articles[worker]
+                elapsed = time.time() - self.started[worker]
+                hung = self.timeout and ordinal >= 0 and article >= 0 and elapsed > self.timeout
+                if hung:
+                    process.terminate()
+            if hung:
+                process.join()
+                self.killed += 1
+                logging.warning("Extract process %d killed after %.0fs on article %d of job %d",
+                                worker, elapsed, article, ordinal)
+                retries.append((ordinal, article, 'timeout'))
+            elif process.is_alive():
+                continue
+            else:
+                process.join()
+                ordinal = self.ordinals[worker]
+                article = self.articles[worker]
+                if ordinal >= 0 and article == Supervisor.written:
+                    self.crashed += 1
+                    logging.warning("Extract process %d died with exit code %s after writing job %d",
+                                    worker, process.exitcode, ordinal)
+                    self.done(ordinal)
+                elif ordinal >= 0 and article == Supervisor.writing:
+                    self.crashed += 1
+                    logging.warning("Extract process %d died with exit code %s writing job %d",
+                                    worker, process.exitcode, ordinal)
+                    retries.append((ordinal, None, None))
+                elif ordinal >= 0:
+                    self.crashed += 1
+                    logging.warning("Extract process %d died with exit code %s on article %d of job %d",
+                                    worker, process.exitcode, article, ordinal)
+                    retries.append((ordinal, article, 'crash'))
+                elif process.exitcode:
+                    self.crashed += 1
+                    logging.warning("Extract process %d died with exit code %s",
+                                    worker, process.exitcode)
+                else:
+                    self.recycled += 1
+            self.ordinals[worker] = -1
+            self.spawn(worker)
+        # the jobs done by processes before dying are not dispatched again
+        self.received()
+        # after spawning processes to take them
+        for ordinal, article, error in retries:
+            job = self.retry(ordinal, article, error)
+            if job:
+                self.jobs_queue.put(job)
+
+    def received(self):
+        """
+        Forget the jobs whose ordinals are in the done queue.
+        """
+        while not self.done_queue.empty():
+            self.done(self.done_queue.get())
+
+    def done(self, ordinal):
+        """
+        Forget job :param ordinal:, releasing its text.
+        """
+        job = self.pending.pop(ordinal, None)
+        if job and self.ring and job[3]:
+            self.ring.release(job[3])
+
+    def retry(self, ordinal, article=None, error=None):
+        """
+        :return: job :param ordinal: with an error record in place of
+            :param article:, if any, or None if it was received meanwhile.
+        """
+        job = self.pending.get(ordinal)
+        if job and article is not None:
+            skip = dict(job[-1])
+            skip[article] = error
+            job = self.pending[ordinal] = job[:-1] + (skip,)
+        return job
+
+
+class Metrics():
+    """
+    Counters of the progress of an extraction, in shared memory: the mapper,
+    the reduce process and each extract process update their own, and the
+    main process renders them all in the Prometheus text format, to a file or
+    through HTTP, so that one can tell whether reading, extracting or writing
+    is the bottleneck.
+    """
+
+    def __init__(self, context, workers):
+        """
+        :param context: the multiprocessing context.
+        :param workers: number of extract processes.
+        """
+        self.start = time.time()
+        # updated by the mapper
+        self.input_bytes = context.RawValue('q', 0)  # position in the dump file
+        self.input_chars = context.RawValue('q', 0)  # of decompressed pages
+        self.pages = context.RawValue('q', 0)
+        self.jobs = context.RawValue('q', 0)
+        # updated by the reduce process
+        self.reorder_items = context.RawValue('q', 0)
+        self.reorder_chars = context.RawValue('q', 0)
+        self.articles = context.RawValue('q', 0)
+        self.output_chars = context.RawValue('q', 0)
+        # updated by each extract process
+        self.block_bytes = context.RawArray('q', workers)  # read with an index
+        self.block_chars = context.RawArray('q', workers)
+        self.busy = context.RawArray('d', workers)  # seconds
+        self.extracted = context.RawArray('q', workers)
+        self.cache_hits = context.RawArray('q', workers)
+        self.cache_misses = context.RawArray('q', workers)
+        self.over_budget = context.RawArray('q', workers)
+        self.queues = {}        # name: Queue, whose length is sampled
+        self.server = None
+        self.stopped = None
+
+    def dispatched(self, batch, input):
+        """
+        Count a job of pages in :param batch:, read from file :param input:.
+        """
+        self.jobs.value += 1
+        self.pages.value += len(batch)
+        self.input_chars.value += sum(len(line) for _, _, _, page in batch for line in page)
+        try:
+            self.input_bytes.value = input.tell()
+        except (OSError, ValueError):
+            pass                # not seekable
+
+    def extracted_job(self, worker, articles, seconds, over_budget=0):
+        """
+        Count a job of :param articles: completed by extract process
+        :param worker: in :param seconds:, :param over_budget: of which
+        exceeded their budget.
+        """
+        self.extracted[worker] += articles
+        self.over_budget[worker] += over_budget
+        self.busy[worker] += seconds
+        self.cache_hits[worker] = templateCache.hits
+        self.cache_misses[worker] = templateCache.misses
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text exposition format.
+        """
+        elapsed = max(time.time() - self.start, 1e-6)
+        input_chars = self.input_chars.value + sum(self.block_chars)
+        hits = sum(self.cache_hits)
+        lookups = hits + sum(self.cache_misses)
+        lines = []
+
+        def metric(name, kind, help, value, label=None):
+            lines.append('# HELP wikiextractor_%s %s' % (name, help))
+            lines.append('# TYPE wikiextractor_%s %s' % (name, kind))
+            if label:
+                for key, v in value:
+                    lines.append('wikiextractor_%s{%s="%s"} %s' % (name, label, key, v))
+            else:
+                lines.append('wikiextractor_%s %s' % (name, value))
+
+        metric('uptime_seconds', 'gauge', 'Seconds since the extraction started.',
+               '%.3f' % elapsed)
+        metric('input_bytes_total', 'counter', 'Bytes of the dump file read.',
+               self.input_bytes.value + sum(self.block_bytes))
+        metric('input_chars_total', 'counter', 'Characters of page text decompressed and read.',
+               input_chars)
+        metric('input_chars_per_second', 'gauge', 'Average rate of decompression and reading.',
+               '%.1f' % (input_chars / elapsed))
+        metric('pages_dispatched_total', 'counter', 'Pages dispatched to extract processes.',
+               self.pages.value)
+        metric('jobs_dispatched_total', 'counter', 'Batches or blocks dispatched to extract processes.',
+               self.jobs.value)
+        depths = []
+        for name, queue in sorted(self.queues.items()):
+            try:
+                depths.append((name, queue.qsize()))
+            except NotImplementedError:  # macOS
+                pass
+        if depths:
+            metric('queue_length', 'gauge', 'Items waiting in a queue.', depths, 'queue')
+        metric('reorder_buffer_items', 'gauge', 'Jobs held to be written in order.',
+               self.reorder_items.value)
+        metric('reorder_buffer_chars', 'gauge', 'Characters, or compressed bytes, held to be written in order.',
+               self.reorder_chars.value)
+        metric('articles_extracted_total', 'counter', 'Articles extracted by each process.',
+               enumerate(self.extracted), 'worker')
+        metric('articles_over_budget_total', 'counter',
+               'Articles whose templates were partly dropped for exceeding their budget.',
+               sum(self.over_budget))
+        metric('worker_busy_seconds_total', 'counter', 'Seconds each extract process spent extracting.',
+               ((i, '%.3f' % busy) for i, busy in enumerate(self.busy)), 'worker')
+        metric('worker_busy_ratio', 'gauge', 'Fraction of the time each extract process spent extracting.',
+               ((i, '%.3f' % (busy / elapsed)) for i, busy in enumerate(self.busy)), 'worker')
+        metric('articles_written_total', 'counter', 'Articles written to output.',
+               self.articles.value)
+        metric('output_chars_total', 'counter', 'Characters, or compressed bytes, written to output.',
+               self.output_chars.value)
+        metric('template_cache_hits_total', 'counter', 'Hits of the caches of parsed templates.', hits)
+        metric('template_cache_lookups_total', 'counter', 'Lookups in the caches of parsed templates.',
+               lookups)
+        metric('template_cache_hit_ratio', 'gauge', 'Hit rate of the caches of parsed templates.',
+               '%.4f' % (hits / lookups if lookups else 0.0))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """
+        Write the metrics to :param filename:, replacing it atomically, as
+        expected by the textfile collector of the node exporter.
+        """
+        temp = filename + '.tmp'
+        with open(temp, 'w') as file:
+            file.write(self.render())
+        os.replace(temp, filename)
+
+    def report(self, filename=None, port=None, interval=10):
+        """
+        Start threads that write the metrics to :param filename: every
+        :param interval: seconds, and serve them at
+        http://localhost:port/metrics.
+        Call it after starting the other processes, which must not inherit
+        the threads.
+        """
+        if filename:
+            self.stopped = threading.Event()
+
+            def writer():
+                while not self.stopped.wait(interval):
+                    self.write(filename)
+
+            threading.Thread(target=writer, daemon=True).start()
+        if port:
+            self.server = HTTPServer(('localhost', port), MetricsHandler)
+            self.server.metrics = self
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            logging.info("Serving metrics at http://localhost:%d/metrics", port)
+
+    def close(self, filename=None):
+        """
+        Stop reporting, writing the final metrics to :param filename:.
+        """
+        if self.stopped:
+            self.stopped.set()
+        if filename:
+            self.write(filename)
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the Metrics of the server at /metrics."""
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass                    # not worth logging
+
+
+def merge_profiles(output_queue, profile):
+    """
+    Merge into :param profile: those that extract processes writing their
+    own output send through :param output_queue:, until None.
+    """
+    while True:
+        item = output_queue.get()
+        if not item:
+            break
+        profile.merge(item)
+
+
+def output_size(text):
+    """
+    :return: the size of :param text:, output by job_output().
+    """
+    return sum(map(len, text)) if isinstance(text, list) else len(text)
+
+
+def write_output(output, text, spans, doc_index=None):
+    """
+    Write :param text: output by job_output() to the OutputSplitter
+    :param output:, each article apart if it is a list, recording the byte
+    :param spans: of its documents in the DocIndexPart :param doc_index:.
+    """
+    if isinstance(text, list):
+        for piece, piece_spans in zip(text, spans):
+            write_output(output, piece, piece_spans, doc_index)
+        return
+    output.write(text)
+    if spans:
+        doc_index.add(os.path.relpath(output.filename, output.nextFile.path_name),
+                      output.offset, output.file.tell() - output.offset, spans)
+
+
+def reduce_process(output_queue, output, ordered=True, buffer_limit=None, checkpoint=None,
+                   profile=None, profile_file=None, metrics=None, done_queue=None, doc_index=None):
     """
     Pull finished article text, write series of files (or stdout)
     :param output_queue: text to be output.
     :param output: file object where to print.
+    :param ordered: whether to write articles in the order of the dump, or as
+        soon as they are received.
+    :param buffer_limit: a BufferLimit, where to record the size of the text
+        waiting to be written.
+    :param checkpoint: a Checkpoint, to update whenever an output file is
+        complete.
+    :param profile: a Profile where to merge those sent by extract processes.
+    :param profile_file: file where to write the report of :param profile:.
+    :param metrics: the Metrics where to count articles written.
+    :param done_queue: where to put the ordinal of each job received, for
+        the Supervisor of extract processes, which may dispatch a job again:
+        the output of a job received twice is written once.
+    :param doc_index: a DocIndexPart where to record the documents written.
     """
 
     interval_start = default_timer()
     period = 100000
-    # FIXME: use a heap
-    ordering_buffer = {}  # collected pages
+    ordering_buffer = []  # heap of collected (ordinal, text, count, spans)
+    buffered = 0  # size of text in ordering_buffer
+    max_buffered = 0
+    max_buffer_length = 0
     next_ordinal = 0  # sequence number of pages
+    received = set()  # ordinals received, from low on
+    low = 0  # all ordinals below it were received
+    articles = 0  # count of articles written
+    reported = 0  # count at last progress report
     while True:
-        if next_ordinal in ordering_buffer:
-            output.write(ordering_buffer.pop(next_ordinal))
+        if ordering_buffer and ordering_buffer[0][0] == next_ordinal:
+            ordinal, text, count, spans = heapq.heappop(ordering_buffer)
+            size = output_size(text)
+            buffered -= size
+            if checkpoint:
+                current = (output.nextFile.dir_index, output.nextFile.file_index)
+            write_output(output, text, spans, doc_index)
+            if checkpoint and (output.nextFile.dir_index, output.nextFile.file_index) != current:
+                # the current file was closed, with the text before this
+                checkpoint.commit(articles, next_ordinal, current)
             next_ordinal += 1
+            articles += count
+            if metrics:
+                metrics.articles.value = articles
+                metrics.output_chars.value += size
+                metrics.reorder_items.value = len(ordering_buffer)
+                metrics.reorder_chars.value = buffered
+            if buffer_limit and not (ordering_buffer and ordering_buffer[0][0] == next_ordinal):
+                buffer_limit.update(buffered)
             # progress report
-            if next_ordinal % period == 0:
-                interval_rate = period / (default_timer() - interval_start)
+            if articles - reported >= period:
+                interval_rate = (articles - reported) / (default_timer() - interval_start)
                 logging.info("Extracted %d articles (%.1f art/s)",
-                             next_ordinal, interval_rate)
+                             articles, interval_rate)
                 interval_start = default_timer()
+                reported = articles
         else:
             # mapper puts None to signal finish
-            pair = output_queue.get()
-            if not pair:
+            item = output_queue.get()
+            if not item:
                 break
-            ordinal, text = pair
-            ordering_buffer[ordinal] = text
+            if isinstance(item, Profile):
+                profile.merge(item)
+                continue
+            if done_queue:
+                ordinal = item[0]
+                done_queue.put(ordinal)
+                if ordinal < low or ordinal in received:
+                    continue    # dispatched again by the Supervisor
+                received.add(ordinal)
+                while low in received:
+                    received.remove(low)
+                    low += 1
+            if ordered:
+                heapq.heappush(ordering_buffer, item)
+                buffered += output_size(item[1])
+                max_buffered = max(max_buffered, buffered)
+                max_buffer_length = max(max_buffer_length, len(ordering_buffer))
+                if buffer_limit:
+                    buffer_limit.update(buffered)
+                if metrics:
+                    metrics.reorder_items.value = len(ordering_buffer)
+                    metrics.reorder_chars.value = buffered
+            else:
+                write_output(output, item[1], item[3], doc_index)
+                articles += item[2]
+                if metrics:
+                    metrics.articles.value = articles
+                    metrics.output_chars.value += output_size(item[1])
+    if ordered:
+        logging.info("Reorder buffer held at most %d items, %.1f MB",
+                     max_buffer_length, max_buffered / 1024 ** 2)
+    if profile:
+        with open(profile_file, 'w') as file:
+            profile.report(file)
+        logging.info("Wrote profile of %d articles to %s", profile.articles, profile_file)
+    # output was inherited from the parent: it must be closed here, or what is
+    # still buffered is lost when this process exits.
+    if output != sys.stdout:
+        output.close()
+        if doc_index:
+            doc_index.close()
+        if checkpoint:
+            checkpoint.commit(articles, next_ordinal,
+                              (output.nextFile.dir_index, output.nextFile.file_index), True)
 
 
 # ----------------------------------------------------------------------
@@ -529,6 +2352,17 @@ def reduce_process(output_queue, output):
 minFileSize = 200 * 1024
 
 
+def parse_size(size):
+    """
+    :param size: a size, with an optional suffix K, M or G.
+    :return: the size in bytes.
+    """
+    power = 'kmg'.find(size[-1].lower()) + 1
+    if power:
+        size = size[:-1]
+    return int(size) * 1024 ** power
+
+
 def main():
     global acceptedNamespaces
     global templateCache
@@ -546,8 +2380,24 @@ def main():
                         metavar="n[KMG]")
     groupO.add_argument("-c", "--compress", action="store_true",
                         help="compress output files using bzip")
+    groupO.add_argument("--compression", choices=sorted(outputCodecs),
+                        help="compress output files with this codec, implies -c (default bz2)")
+    groupO.add_argument("--compression-level", type=int, metavar="n",
+                        help="compression level, from 1 (fastest) to 9 (smallest), "
+                        "default 9 for bz2 and gzip, 6 for lzma")
     groupO.add_argument("--json", action="store_true",
                         help="write output in json format instead of the default <doc> format")
+    groupO.add_argument("--unordered", action="store_true",
+                        help="write articles as soon as they are extracted, rather than in dump order")
+    groupO.add_argument("--sharded", action="store_true",
+                        help="each extract process writes its own files, wiki_wNN_MM, in no particular order, "
+                        "listed with their size in manifest.json")
+    groupO.add_argument("--doc-index", action="store_true",
+                        help="write docs.idx, an index of the documents in the output files by page id, "
+                        "to read each of them without decompressing whole files")
+    groupO.add_argument("--reorder-buffer", default="512M", metavar="n[KMG]",
+                        help="maximum size of the text held to write articles in order (default %(default)s), "
+                        "beyond which reading pauses; 0 means no limit")
 
     groupP = parser.add_argument_group('Processing')
     groupP.add_argument("--html", action="store_true",
@@ -558,8 +2408,58 @@ def main():
                         help="accepted namespaces")
     groupP.add_argument("--templates",
                         help="use or create file containing templates")
+    groupP.add_argument("--templates-db",
+                        help="use or create a database of parsed templates")
+    groupP.add_argument("--template-cache", type=int, default=0, metavar="n",
+                        help="maximum number of parsed templates cached by each process (default no limit)")
+    groupP.add_argument("--preload-templates", type=int, default=0, metavar="n",
+                        help="number of most used templates to parse once and share among processes")
+    groupP.add_argument("--expansion-cache", default="0", metavar="n[KMG]",
+                        help="maximum size of the cache of template expansions of each process (default %(default)s, no cache)")
+    groupP.add_argument("--index",
+                        help="index file of a multistream dump, to let each process decompress its own blocks")
+    groupP.add_argument("--split", action="store_true",
+                        help="split an uncompressed dump into blocks of --batch-bytes, to let each process "
+                        "read and parse its own blocks")
+    groupP.add_argument("--reader", default="regex", choices=sorted(pageReaders),
+                        help="how to parse the XML of the dump (default %(default)s)")
+    groupP.add_argument("--decompressor", default="auto",
+                        choices=["auto", "python"] + [name for name, _, _ in inputDecompressors],
+                        help="program to decompress the dump with, in parallel: auto uses the first installed "
+                        "one, python the standard library (default %(default)s)")
     groupP.add_argument("--no-templates", action="store_true",
                         help="Do not expand templates")
+    groupP.add_argument("--article-time", type=float, default=0, metavar="SECONDS",
+                        help="time after which the remaining templates of an article are dropped rather "
+                        "than expanded (default 0, no limit)")
+    groupP.add_argument("--article-expansions", type=int, default=0, metavar="n",
+                        help="number of template expansions after which the remaining templates of an "
+                        "article are dropped (default 0, no limit)")
+    groupP.add_argument("--preprocessor", default="regex", choices=["regex", "tree"],
+                        help="how to parse templates for expansion: substituting parameters into their text, "
+                        "or parsing them once into a tree (default %(default)s)")
+    groupP.add_argument("--batch-size", type=int, default=10, metavar="n",
+                        help="number of articles dispatched together to an extract process (default %(default)s)")
+    groupP.add_argument("--batch-bytes", default="1M", metavar="n[KMG]",
+                        help="maximum size of the articles dispatched together (default %(default)s)")
+    groupP.add_argument("--shared-buffer", default="0", metavar="n[KMG]",
+                        help="size of a shared memory buffer through which to pass pages to extract processes "
+                        "(default 0, pass them through a pipe)")
+    groupP.add_argument("--worker-articles", type=int, default=0, metavar="n",
+                        help="number of articles after which an extract process is replaced by a fresh one "
+                        "(default 0, no limit)")
+    groupP.add_argument("--worker-memory", default="0", metavar="n[KMG]",
+                        help="resident memory above which an extract process is replaced by a fresh one "
+                        "(default 0, no limit)")
+    groupP.add_argument("--worker-timeout", type=float, default=0, metavar="SECONDS",
+                        help="time after which an extract process still on an article is killed, and the "
+                        "article output as an error record (default 0, no limit)")
+    groupP.add_argument("--revisions", metavar="FILE",
+                        help="index of the page revisions of the previous extraction, to extract only new "
+                        "or changed pages and mark deleted ones; created or updated at the end")
+    groupP.add_argument("--adds-changes", action="store_true",
+                        help="the dump holds only added and changed pages, as adds-changes dumps, "
+                        "so no page is marked as deleted")
     groupP.add_argument("--html-safe", default=True,
                         help="use to produce HTML safe output within <doc>...</doc>")
     default_process_count = cpu_count() - 1
@@ -567,6 +2467,23 @@ def main():
                         help="Number of processes to use (default %(default)s)")
 
     groupS = parser.add_argument_group('Special')
+    groupS.add_argument("--checkpoint", action="store_true",
+                        help="record the progress of the extraction in the output directory, "
+                        "so that it can be resumed")
+    groupS.add_argument("--resume", action="store_true",
+                        help="resume an interrupted extraction into the output directory")
+    groupS.add_argument("--profile-stages", metavar="FILE",
+                        help="record the time spent in each stage of extraction and in templates, "
+                        "and write a report to FILE")
+    groupS.add_argument("--profile-top", type=int, default=20, metavar="n",
+                        help="number of slowest articles and templates in the report (default %(default)s)")
+    groupS.add_argument("--metrics", metavar="FILE",
+                        help="write metrics of the progress of the extraction to FILE, in the Prometheus "
+                        "text format")
+    groupS.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve metrics of the progress of the extraction at http://localhost:PORT/metrics")
+    groupS.add_argument("--metrics-interval", type=float, default=10, metavar="SECONDS",
+                        help="interval between writes of the metrics file (default %(default)s)")
     groupS.add_argument("-q", "--quiet", action="store_true",
                         help="suppress reporting progress info")
     groupS.add_argument("--debug", action="store_true",
@@ -584,17 +2501,58 @@ def main():
     if args.html:
         Extractor.keepLinks = True
     Extractor.to_json = args.json
+    Extractor.preprocessor = args.preprocessor
+    Extractor.maxArticleSeconds = args.article_time
+    Extractor.maxArticleExpansions = args.article_expansions
+    templateCache.maxsize = args.template_cache
 
     try:
-        power = 'kmg'.find(args.bytes[-1].lower()) + 1
         # 0 bytes means put a single article per file.
-        file_size = 0 if args.bytes == '0' else int(args.bytes[:-1]) * 1024 ** power
+        file_size = parse_size(args.bytes)
         if file_size and file_size < minFileSize:
             raise ValueError()
     except ValueError:
         logging.error('Insufficient or invalid size: %s', args.bytes)
         return
 
+    try:
+        expansionCache.maxsize = parse_size(args.expansion_cache)
+    except ValueError:
+        logging.error('Invalid size: %s', args.expansion_cache)
+        return
+
+    try:
+        batch_bytes = parse_size(args.batch_bytes)
+    except ValueError:
+        logging.error('Invalid size: %s', args.batch_bytes)
+        return
+
+    try:
+        buffer_limit = parse_size(args.reorder_buffer)
+    except ValueError:
+        logging.error('Invalid size: %s', args.reorder_buffer)
+        return
+
+    try:
+        shared_buffer = parse_size(args.shared_buffer)
+    except ValueError:
+        logging.error('Invalid size: %s', args.shared_buffer)
+        return
+
+    try:
+        worker_memory = parse_size(args.worker_memory)
+    except ValueError:
+        logging.error('Invalid size: %s', args.worker_memory)
+        return
+
+    compress = None
+    if args.compress or args.compression:
+        try:
+            compress = Compressor(args.compression or 'bz2', args.compression_level)
+        except ValueError:
+            logging.error('Invalid compression level: %s', args.compression_level)
+            return
+
     if args.namespaces:
         acceptedNamespaces = set(args.namespaces.split(','))
 
@@ -617,15 +2575,22 @@ def main():
     # templateCache = manager.dict()
 
     if args.article:
-        if args.templates:
+        if args.templates_db and os.path.exists(args.templates_db):
+            use_template_db(args.templates_db)
+        elif args.templates:
             if os.path.exists(args.templates):
                 with open(args.templates) as file:
-                    load_templates(file)
+                    load_templates(file, reader=args.reader)
 
+        if args.profile_stages:
+            Extractor.profile = Profile(args.profile_top)
         urlbase = ''
         with open(input_file) as input:
-            for id, revid, title, page in collect_pages(input):
+            for id, revid, title, page in collect_pages(input, args.reader):
                 Extractor(id, revid, urlbase, title, page).extract(sys.stdout)
+        if args.profile_stages:
+            with open(args.profile_stages, 'w') as file:
+                Extractor.profile.report(file)
         return
 
     output_path = args.output
@@ -637,7 +2602,14 @@ def main():
             return
 
     process_dump(input_file, args.templates, output_path, file_size,
-                 args.compress, args.processes, args.html_safe, not args.no_templates)
+                 compress, args.processes, args.html_safe, not args.no_templates,
+                 args.index, args.reader, args.templates_db, args.preload_templates,
+                 max(1, args.batch_size), batch_bytes, not args.unordered, buffer_limit,
+                 shared_buffer, args.checkpoint, args.resume, args.revisions, args.adds_changes,
+                 args.profile_stages, max(1, args.profile_top),
+                 args.metrics, args.metrics_port, args.metrics_interval,
+                 args.worker_articles, worker_memory, args.worker_timeout, args.sharded,
+                 args.doc_index, args.decompressor, args.split)
 
 if __name__ == '__main__':
     main()
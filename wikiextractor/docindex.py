@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""
+Index of the documents in the output files of WikiExtractor, by page id.
+
+Output files are written in blocks: the text of a batch of articles, or of a
+multistream block, which is a single stream when compressed. Each document is
+located by its file, the offset and length of its block in the file, and its
+offset and length within the uncompressed block, so it can be read without
+decompressing the whole file:
+
+    from wikiextractor.docindex import DocIndex
+
+    index = DocIndex('text/docs.idx')
+    text = index.get(12)
+
+The index file holds, after a header, fixed size records sorted by id, which
+are binary searched through mmap, then the titles and the list of files:
+
+    header      magic, count of records, offset of the list of files
+    records     id, file, block offset, block length, offset, length,
+                title offset, title length
+    titles      UTF-8
+    files       JSON list of paths, relative to the index
+"""
+
+import bz2
+import gzip
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+try:
+    import lzma
+except ImportError:             # Python built without liblzma
+    lzma = None
+
+##
+# Decompressors of blocks of output files, by extension.
+blockDecompressors = {
+    '.bz2': bz2.decompress,
+    '.gz': gzip.decompress,
+}
+if lzma:
+    blockDecompressors['.xz'] = lzma.decompress
+
+header = struct.Struct('<8sQQ')
+record = struct.Struct('<QIQIIIQI')
+magic = b'WXDOCS01'
+
+
+def byte_spans(text, docs):
+    """
+    :param text: the text of a block.
+    :param docs: list of (id, start, length, title) of the documents in
+        :param text:, in order, with start and length in characters.
+    :return: the list with start and length in bytes of UTF-8.
+    """
+    spans = []
+    position = 0
+    for id, start, length, title in docs:
+        size = len(text[start:start + length].encode('utf-8'))
+        spans.append((id, position, size, title))
+        position += size
+    return spans
+
+
+class DocIndexPart():
+    """
+    Records of the documents written by one writer of output files, kept in
+    files which are appended to, prefix.records, prefix.titles and
+    prefix.files, so that a writer replacing a killed one continues them.
+    They are merged into a DocIndex by write_doc_index().
+    """
+
+    def __init__(self, prefix):
+        """
+        :param prefix: the path of the part files, without extension.
+        """
+        self.prefix = prefix
+        self.records = None
+
+    def clear(self):
+        """
+        Remove the files of the part, left by a previous run.
+        """
+        for extension in ('.records', '.titles', '.files'):
+            if os.path.exists(self.prefix + extension):
+                os.remove(self.prefix + extension)
+
+    def open(self):
+        self.records = open(self.prefix + '.records', 'ab')
+        self.titles = open(self.prefix + '.titles', 'ab')
+        self.files = open(self.prefix + '.files', 'a+')
+        self.files.seek(0)
+        self.paths = self.files.read().splitlines()
+
+    def add(self, path, block_offset, block_length, docs):
+        """
+        Record the documents of a block.
+        :param path: the file where the block was written, relative to the
+            output directory.
+        :param block_offset: the offset of the block in the file.
+        :param block_length: the length of the block in the file.
+        :param docs: list of (id, offset, length, title) of its documents,
+            with offset and length in bytes within the uncompressed block.
+        """
+        if not self.records:
+            self.open()
+        if not self.paths or self.paths[-1] != path:
+            self.paths.append(path)
+            self.files.write(path + '\n')
+            self.files.flush()
+        file = len(self.paths) - 1
+        records = []
+        for id, offset, length, title in docs:
+            title = title.encode('utf-8')
+            records.append(record.pack(int(id), file, block_offset, block_length, offset, length,
+                                       self.titles.tell(), len(title)))
+            self.titles.write(title)
+        # titles first, in case this process is killed
+        self.titles.flush()
+        self.records.write(b''.join(records))
+        self.records.flush()
+
+    def close(self):
+        if self.records:
+            self.records.close()
+            self.titles.close()
+            self.files.close()
+            self.records = None
+
+
+def write_doc_index(filename, parts):
+    """
+    Merge the :param parts:, a list of DocIndexPart, into the DocIndex
+    :param filename:, removing their files.
+    :return: the number of documents indexed.
+    """
+    paths = []
+    ids = array('Q')
+    temp = filename + '.tmp'
+    with open(temp + '.records', 'w+b') as records, open(temp + '.titles', 'w+b') as titles:
+        # concatenate the parts, renumbering files and titles
+        for part in parts:
+            if not os.path.exists(part.prefix + '.records'):
+                continue
+            with open(part.prefix + '.files') as file:
+                base = len(paths)
+                paths.extend(file.read().splitlines())
+            title_base = titles.tell()
+            with open(part.prefix + '.titles', 'rb') as file:
+                titles.write(file.read())
+            with open(part.prefix + '.records', 'rb') as file:
+                data = file.read()
+            data = data[:len(data) - len(data) % record.size]  # of a killed writer
+            for (id, number, block_offset, block_length, offset, length,
+                 title_offset, title_length) in record.iter_unpack(data):
+                records.write(record.pack(id, base + number, block_offset, block_length, offset, length,
+                                          title_base + title_offset, title_length))
+                ids.append(id)
+            part.clear()
+        count = len(ids)
+        records.flush()
+        with open(filename, 'wb') as output:
+            titles_length = titles.tell()
+            output.write(header.pack(magic, count, header.size + count * record.size + titles_length))
+            if count:
+                data = mmap.mmap(records.fileno(), 0, access=mmap.ACCESS_READ)
+                if all(ids[i] <= ids[i + 1] for i in range(count - 1)):
+                    output.write(data)
+                else:
+                    for i in sorted(range(count), key=ids.__getitem__):
+                        output.write(data[i * record.size:(i + 1) * record.size])
+                data.close()
+            titles.seek(0)
+            output.write(titles.read())
+            output.write(json.dumps(paths).encode('utf-8'))
+    os.remove(temp + '.records')
+    os.remove(temp + '.titles')
+    return count
+
+
+class DocIndex():
+    """
+    Reader of the index of documents of an extraction, written by
+    write_doc_index().
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: the index file, in the output directory.
+        """
+        self.path = os.path.dirname(filename)
+        with open(filename, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        tag, self.count, files = header.unpack_from(self.data)
+        if tag != magic:
+            raise ValueError("%s is not an index of documents" % filename)
+        self.titles = header.size + self.count * record.size
+        self.files = json.loads(self.data[files:].decode('utf-8'))
+
+    def __len__(self):
+        return self.count
+
+    def record(self, i):
+        return record.unpack_from(self.data, header.size + i * record.size)
+
+    def __getitem__(self, i):
+        # the id of record i, to bisect
+        return struct.unpack_from('<Q', self.data, header.size + i * record.size)[0]
+
+    def lookup(self, id):
+        """
+        :return: (file, block offset, block length, offset, length, title) of
+            the document with :param id:, or None.
+        """
+        id = int(id)
+        i = bisect_left(self, id)
+        if i == self.count or self[i] != id:
+            return None
+        _, file, block_offset, block_length, offset, length, title_offset, title_length = self.record(i)
+        start = self.titles + title_offset
+        title = self.data[start:start + title_length].decode('utf-8')
+        return self.files[file], block_offset, block_length, offset, length, title
+
+    def __contains__(self, id):
+        return self.lookup(id) is not None
+
+    def get(self, id):
+        """
+        :return: the text of the document with :param id:, as written in the
+            output, or None.
+        """
+        entry = self.lookup(id)
+        if not entry:
+            return None
+        path, block_offset, block_length, offset, length, _ = entry
+        path = os.path.join(self.path, path)
+        decompress = blockDecompressors.get(os.path.splitext(path)[1])
+        with open(path, 'rb') as file:
+            if decompress:
+                file.seek(block_offset)
+                block = decompress(file.read(block_length))
+                data = block[offset:offset + length]
+            else:
+                file.seek(block_offset + offset)
+                data = file.read(length)
+        return data.decode('utf-8')
@@ -21,13 +21,40 @@
 import re
 import html
 import json
+import os
+import heapq
+import pickle
+import sqlite3
+from pathlib import Path
+from collections import Counter, OrderedDict
 from itertools import zip_longest
 from urllib.parse import quote as urlencode
 from html.entities import name2codepoint
 import logging
 import time
+from timeit import default_timer
+
+from .preprocessor import preprocess, TemplateNode, TplArgNode, ExtNode, HeadingNode
 
 # ----------------------------------------------------------------------
+# Patterns
+
+# Patterns built at run time are compiled once by compiled() and kept here,
+# since the cache of the re module holds at most 512 patterns and is
+# thrashed by the many patterns of an extraction.
+patternRegistry = {}
+
+
+def compiled(pattern, flags=0):
+    """
+    :return: :param pattern: compiled with :param flags:, from the registry.
+    """
+    try:
+        return patternRegistry[pattern, flags]
+    except KeyError:
+        regex = patternRegistry[pattern, flags] = re.compile(pattern, flags)
+        return regex
+
 
 # match tail after wikilink
 tailRE = re.compile('\w+')
@@ -67,6 +94,13 @@ def get_url(urlbase, uid):
 # ======================================================================
 
 
+# Match spaces before closing or after opening punctuation, and lines with
+# only punctuation, for cleanup
+spaceBefore = re.compile(u' (,:\.\)\]»)')
+spaceAfter = re.compile(u'(\[\(«) ')
+punctuationLine = re.compile(r'\n\W+?\n', re.U)
+
+
 def clean(extractor, text, expand_templates=False, html_safe=True):
     """
     Transforms wiki markup. If the command line flag --escapedoc is set then the text is also escaped
@@ -85,29 +119,36 @@ def clean(extractor, text, expand_templates=False, html_safe=True):
     else:
         # Drop transclusions (template, parser functions)
         text = dropNested(text, r'{{', r'}}')
+    extractor.lap('templates')
 
     # Drop tables
     text = dropNested(text, r'{\|', r'\|}')
+    extractor.lap('tables')
 
     # replace external links
     text = replaceExternalLinks(text)
+    extractor.lap('external links')
 
     # replace internal links
     text = replaceInternalLinks(text)
+    extractor.lap('internal links')
 
     # drop MagicWords behavioral switches
     text = magicWordsRE.sub('', text)
+    extractor.lap('magic words')
 
     # ############### Process HTML ###############
 
     # turn into HTML, except for the content of <syntaxhighlight>
-    res = ''
+    res = []
     cur = 0
     for m in syntaxhighlight.finditer(text):
-        end = m.end()
-        res += unescape(text[cur:m.start()]) + m.group(1)
-        cur = end
-    text = res + unescape(text[cur:])
+        res.append(unescape(text[cur:m.start()]))
+        res.append(m.group(1))
+        cur = m.end()
+    res.append(unescape(text[cur:]))
+    text = ''.join(res)
+    extractor.lap('unescape')
 
     # Handle bold/italic/quote
     if extractor.HtmlFormatting:
@@ -122,32 +163,18 @@ def clean(extractor, text, expand_templates=False, html_safe=True):
         text = quote_quote.sub(r'"\1"', text)
     # residuals of unbalanced quotes
     text = text.replace("'''", '').replace("''", '"')
+    extractor.lap('quotes')
 
-    # Collect spans
-
-    spans = []
-    # Drop HTML comments
-    for m in comment.finditer(text):
-        spans.append((m.start(), m.end()))
-
-    # Drop self-closing tags
-    for pattern in selfClosing_tag_patterns:
-        for m in pattern.finditer(text):
-            spans.append((m.start(), m.end()))
-
-    # Drop ignored tags
-    for left, right in ignored_tag_patterns:
-        for m in left.finditer(text):
-            spans.append((m.start(), m.end()))
-        for m in right.finditer(text):
-            spans.append((m.start(), m.end()))
+    # Collect spans of HTML comments, self-closing tags and ignored tags
+    spans = tagSpans(text)
 
     # Bulk remove all spans
     text = dropSpans(spans, text)
+    extractor.lap('tag spans')
 
     # Drop discarded elements
-    for tag in discardElements:
-        text = dropNested(text, r'<\s*%s\b[^>/]*>' % tag, r'<\s*/\s*%s>' % tag)
+    text = dropDiscarded(text)
+    extractor.lap('discarded')
 
     if not extractor.HtmlFormatting:
         # Turn into text what is left (&amp;nbsp;) and <syntaxhighlight>
@@ -155,12 +182,10 @@ def clean(extractor, text, expand_templates=False, html_safe=True):
 
     # Expand placeholders
     for pattern, placeholder in placeholder_tag_patterns:
-        index = 1
-        for match in pattern.finditer(text):
-            text = text.replace(match.group(), '%s_%d' % (placeholder, index))
-            index += 1
+        text = replacePlaceholders(text, pattern, placeholder)
 
     text = text.replace('<<', u'«').replace('>>', u'»')
+    extractor.lap('placeholders')
 
     #############################################
 
@@ -168,12 +193,13 @@ def clean(extractor, text, expand_templates=False, html_safe=True):
     text = text.replace('\t', ' ')
     text = spaces.sub(' ', text)
     text = dots.sub('...', text)
-    text = re.sub(u' (,:\.\)\]»)', r'\1', text)
-    text = re.sub(u'(\[\(«) ', r'\1', text)
-    text = re.sub(r'\n\W+?\n', '\n', text, flags=re.U)  # lines with only punctuations
+    text = spaceBefore.sub(r'\1', text)
+    text = spaceAfter.sub(r'\1', text)
+    text = punctuationLine.sub('\n', text)  # lines with only punctuations
     text = text.replace(',,', ',').replace(',.', '.')
     if html_safe:
         text = html.escape(text, quote=False)
+    extractor.lap('cleanup')
     return text
 
 
@@ -295,8 +321,8 @@ def dropNested(text, openDelim, closeDelim):
     """
     A matching function for nested expressions, e.g. namespaces and tables.
     """
-    openRE = re.compile(openDelim, re.IGNORECASE)
-    closeRE = re.compile(closeDelim, re.IGNORECASE)
+    openRE = compiled(openDelim, re.IGNORECASE)
+    closeRE = compiled(closeDelim, re.IGNORECASE)
     # partition text in separate blocks { } { }
     spans = []  # pairs (s, e) for each partition
     nest = 0  # nesting level
@@ -344,20 +370,37 @@ def dropNested(text, openDelim, closeDelim):
     return dropSpans(spans, text)
 
 
+def replacePlaceholders(text, pattern, placeholder):
+    """
+    Replace each match of :param pattern: with :param placeholder: and the
+    ordinal of the match, in a single pass. Repeated occurrences of the same
+    text all get the ordinal of the first one.
+    """
+    index = 0
+    first = {}  # text -> ordinal of its first match
+
+    def replace(match):
+        nonlocal index
+        index += 1
+        return '%s_%d' % (placeholder, first.setdefault(match.group(), index))
+
+    return pattern.sub(replace, text)
+
+
 def dropSpans(spans, text):
     """
     Drop from text the blocks identified in :param spans:, possibly nested.
     """
     spans.sort()
-    res = ''
+    res = []
     offset = 0
     for s, e in spans:
         if offset <= s:  # handle nesting
             if offset < s:
-                res += text[offset:s]
+                res.append(text[offset:s])
             offset = e
-    res += text[offset:]
-    return res
+    res.append(text[offset:])
+    return ''.join(res)
 
 
 # ----------------------------------------------------------------------
@@ -389,10 +432,10 @@ EXT_IMAGE_REGEX = re.compile(
 
 
 def replaceExternalLinks(text):
-    s = ''
+    s = []
     cur = 0
     for m in ExtLinkBracketedRegex.finditer(text):
-        s += text[cur:m.start()]
+        s.append(text[cur:m.start()])
         cur = m.end()
 
         url = m.group(1)
@@ -416,9 +459,10 @@ def replaceExternalLinks(text):
         # This means that users can paste URLs directly into the text
         # Funny characters like ö aren't valid in URLs anyway
         # This was changed in August 2004
-        s += makeExternalLink(url, label)  # + trail
+        s.append(makeExternalLink(url, label))  # + trail
 
-    return s + text[cur:]
+    s.append(text[cur:])
+    return ''.join(s)
 
 
 def makeExternalLink(url, anchor):
@@ -454,7 +498,7 @@ def replaceInternalLinks(text):
     # call this after removal of external links, so we need not worry about
     # triple closing ]]].
     cur = 0
-    res = ''
+    res = []
     for s, e in findBalanced(text, ['[['], [']]']):
         m = tailRE.match(text, e)
         if m:
@@ -479,9 +523,12 @@ def replaceInternalLinks(text):
                     pipe = last  # advance
                 curp = e1
             label = inner[pipe + 1:].strip()
-        res += text[cur:s] + makeInternalLink(title, label) + trail
+        res.append(text[cur:s])
+        res.append(makeInternalLink(title, label))
+        res.append(trail)
         cur = end
-    return res + text[cur:]
+    res.append(text[cur:])
+    return ''.join(res)
 
 
 def makeInternalLink(title, label):
@@ -674,14 +721,18 @@ ignoredTags = (
 placeholder_tags = {'math': 'formula', 'code': 'codice'}
 
 
+titleSpaces = re.compile(r'[\s_]+')
+titleNamespace = re.compile(r'([^:]*):(\s*)(\S(?:.*))')
+
+
 def normalizeTitle(title):
     """Normalize title"""
     # remove leading/trailing whitespace and underscores
     title = title.strip(' _')
     # replace sequences of whitespace and underscore chars with a single space
-    title = re.sub(r'[\s_]+', ' ', title)
+    title = titleSpaces.sub(' ', title)
 
-    m = re.match(r'([^:]*):(\s*)(\S(?:.*))', title)
+    m = titleNamespace.match(title)
     if m:
         prefix = m.group(1)
         if m.group(2):
@@ -712,6 +763,9 @@ def normalizeTitle(title):
     return title
 
 
+entity = re.compile(r"&#?(\w+);")
+
+
 def unescape(text):
     """
     Removes HTML or XML character references and entities from a text string.
@@ -734,7 +788,7 @@ def unescape(text):
         except:
             return text  # leave as is
 
-    return re.sub("&#?(\w+);", fixup, text)
+    return entity.sub(fixup, text)
 
 
 # Match HTML comments
@@ -743,17 +797,23 @@ comment = re.compile(r'<!--.*?-->', re.DOTALL)
 
 # Match ignored tags
 ignored_tag_patterns = []
+ignored_tag_names = []          # the tags of ignored_tag_patterns
 
 
 def ignoreTag(tag):
+    global tag_index
     left = re.compile(r'<%s\b.*?>' % tag, re.IGNORECASE | re.DOTALL)  # both <ref> and <reference>
     right = re.compile(r'</\s*%s>' % tag, re.IGNORECASE)
     ignored_tag_patterns.append((left, right))
+    ignored_tag_names.append(tag)
+    tag_index = None
 
 
 def resetIgnoredTags():
-    global ignored_tag_patterns
+    global ignored_tag_patterns, ignored_tag_names, tag_index
     ignored_tag_patterns = []
+    ignored_tag_names = []
+    tag_index = None
 
 
 for tag in ignoredTags:
@@ -764,6 +824,106 @@ selfClosing_tag_patterns = [
     re.compile(r'<\s*%s\b[^>]*/\s*>' % tag, re.DOTALL | re.IGNORECASE) for tag in selfClosingTags
 ]
 
+# Tag stripping is performed in a single scan of the text, looking for the
+# start of tags and trying there just the patterns for that tag.
+
+# Match the start of a comment, a closing tag, or an opening tag
+tagStart = re.compile(r'<(?:(!--)|/\s*(\w+)|(\s*)(\w+))')
+
+nonAscii = re.compile(r'[^\x00-\x7f]')
+
+# Index of the patterns above by tag name, built by tagPatterns()
+tag_index = None
+
+
+def tagPatterns():
+    """
+    :return: a dictionary from lowercase tag names to lists of the patterns
+        that can match: (selfClosing patterns, left patterns, right patterns).
+        Key None holds the lists of all patterns, to try on non ASCII names.
+    """
+    global tag_index
+    if tag_index is None:
+        tag_index = {None: ([], [], [])}
+
+        def add(tag, kind, pattern):
+            tag_index.setdefault(tag.lower(), ([], [], []))[kind].append(pattern)
+            tag_index[None][kind].append(pattern)
+
+        for tag, pattern in zip(selfClosingTags, selfClosing_tag_patterns):
+            add(tag, 0, pattern)
+        for tag, (left, right) in zip(ignored_tag_names, ignored_tag_patterns):
+            add(tag, 1, left)
+            add(tag, 2, right)
+    return tag_index
+
+
+def tagSpans(text):
+    """
+    Find HTML comments, self-closing tags and ignored tags in a single scan.
+    :return: the list of their spans, the same as scanning the text
+        separately with each of their patterns.
+    """
+    index = tagPatterns()
+    spans = []
+    last = {}  # end of the last match of each pattern
+    for m in tagStart.finditer(text):
+        if m.group(1):
+            patterns = (comment,)
+        else:
+            name = m.group(2) or m.group(4)
+            # re.IGNORECASE may equate non ASCII letters to ASCII ones
+            tags = index.get(None if nonAscii.search(name) else name.lower())
+            if not tags:
+                continue
+            if m.group(2):
+                patterns = tags[2]
+            elif m.group(3):
+                patterns = tags[0]
+            else:
+                patterns = tags[0] + tags[1]
+        pos = m.start()
+        for pattern in patterns:
+            # matches of a single pattern do not overlap
+            if last.get(pattern, 0) <= pos:
+                match = pattern.match(text, pos)
+                if match:
+                    spans.append((pos, match.end()))
+                    last[pattern] = match.end()
+    return spans
+
+
+# Match the names of opening tags
+openTag = re.compile(r'<\s*(\w+)')
+
+
+def openTags(text):
+    """
+    :return: the lowercase names of the tags opened in text, or None if some
+        are not ASCII.
+    """
+    names = set(openTag.findall(text))
+    if nonAscii.search(''.join(names)):
+        return None
+    return set(name.lower() for name in names)
+
+
+def dropDiscarded(text):
+    """
+    Drop the elements in discardElements, one kind at a time, skipping those
+    that do not occur in the text.
+    """
+    present = openTags(text)
+    for tag in discardElements:
+        if present is None or tag in present:
+            dropped = dropNested(text, r'<\s*%s\b[^>/]*>' % tag, r'<\s*/\s*%s>' % tag)
+            if len(dropped) != len(text):
+                text = dropped
+                # dropping may join the pieces of a tag
+                present = openTags(text)
+    return text
+
+
 # Match HTML placeholder tags
 placeholder_tag_patterns = [
     (re.compile(r'<\s*%s(\s*| [^>]+?)>.*?<\s*/\s*%s\s*>' % (tag, tag), re.DOTALL | re.IGNORECASE),
@@ -898,9 +1058,103 @@ class TemplateArg():
         return res
 
 
+# ======================================================================
+
+class Profile():
+    """
+    Time spent in each stage of extraction and in template expansions,
+    accumulated over articles, together with the slowest articles.
+    Each extract process fills its own, and the reduce process merges them.
+    """
+
+    def __init__(self, top=20):
+        """
+        :param top: number of slowest articles and templates to report.
+        """
+        self.top = top
+        self.articles = 0
+        self.seconds = 0.0
+        self.frames = 0         # templates instantiated
+        self.deepest = 0        # deepest nesting of templates
+        self.over_budget = 0    # articles exceeding their budget
+        self.stages = {}        # stage: [calls, seconds]
+        self.templates = {}     # title: [calls, seconds]
+        self.slowest = []       # heap of (seconds, id, title, frames, depth, stages)
+
+    def add(self, extractor, seconds):
+        """
+        Record the extraction of an article by :param extractor:, which took
+        :param seconds:.
+        """
+        self.articles += 1
+        self.seconds += seconds
+        self.frames += extractor.frames
+        self.deepest = max(self.deepest, extractor.deepest)
+        self.over_budget += extractor.exhausted
+        self.accumulate(self.stages, extractor.stages)
+        self.accumulate(self.templates, extractor.templateTimes)
+        entry = (seconds, extractor.id, extractor.title, extractor.frames,
+                 extractor.deepest, extractor.stages)
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    @staticmethod
+    def accumulate(totals, counts):
+        for key, (calls, seconds) in counts.items():
+            entry = totals.get(key)
+            if entry is None:
+                totals[key] = [calls, seconds]
+            else:
+                entry[0] += calls
+                entry[1] += seconds
+
+    def merge(self, other):
+        """
+        Add to this profile the Profile :param other:.
+        """
+        self.articles += other.articles
+        self.seconds += other.seconds
+        self.frames += other.frames
+        self.deepest = max(self.deepest, other.deepest)
+        self.over_budget += other.over_budget
+        self.accumulate(self.stages, other.stages)
+        self.accumulate(self.templates, other.templates)
+        self.slowest = heapq.nlargest(self.top, self.slowest + other.slowest)
+        heapq.heapify(self.slowest)
+
+    def report(self, out):
+        """
+        Write a summary of the profile to file :param out:.
+        """
+        out.write('Extracted %d articles in %.1fs of extract processes, '
+                  'instantiating %d templates, at most %d deep\n' %
+                  (self.articles, self.seconds, self.frames, self.deepest))
+        out.write('%d articles exceeded their budget\n\n' % self.over_budget)
+        out.write('%-16s %10s %10s %6s\n' % ('stage', 'calls', 'seconds', '%'))
+        for stage, (calls, seconds) in sorted(self.stages.items(), key=lambda x: -x[1][1]):
+            out.write('%-16s %10d %10.3f %6.1f\n' %
+                      (stage, calls, seconds, 100 * seconds / (self.seconds or 1)))
+        out.write('\nSlowest articles\n')
+        out.write('%10s %10s %8s %6s  %-40s %s\n' %
+                  ('seconds', 'id', 'frames', 'depth', 'title', 'slowest stages'))
+        for seconds, id, title, frames, depth, stages in sorted(self.slowest, reverse=True):
+            slow = sorted(stages.items(), key=lambda x: -x[1][1])[:3]
+            out.write('%10.3f %10s %8d %6d  %-40s %s\n' %
+                      (seconds, id, frames, depth, title,
+                       ', '.join('%s %.3f' % (stage, t) for stage, (_, t) in slow)))
+        out.write('\nTemplates by cumulative time, including the templates they invoke\n')
+        out.write('%10s %10s  %s\n' % ('seconds', 'calls', 'title'))
+        for title, (calls, seconds) in heapq.nlargest(self.top, self.templates.items(),
+                                                      key=lambda x: x[1][1]):
+            out.write('%10.3f %10d  %s\n' % (seconds, calls, title))
+
+
 # ======================================================================
 
 substWords = 'subst:|safesubst:'
+substRE = re.compile(substWords, re.IGNORECASE)
 
 
 class Extractor():
@@ -921,12 +1175,30 @@ class Extractor():
 
     ##
     # Whether to produce json instead of the default <doc> output format.
-    toJson = False
+    to_json = False
 
     ##
     # Obtained from TemplateNamespace
     templatePrefix = ''
 
+    ##
+    # How to parse wikitext for template expansion: 'regex' substitutes
+    # parameters in the text of templates and searches it again for
+    # invocations, 'tree' parses each template once with preprocess() and
+    # expands the tree.
+    preprocessor = 'regex'
+
+    ##
+    # A Profile where to record the time spent in each stage of extraction,
+    # or None not to profile.
+    profile = None
+
+    ##
+    # Budget of each article: seconds and template expansions, 0 for no
+    # limit. Once exceeded, the remaining templates are dropped.
+    maxArticleSeconds = 0
+    maxArticleExpansions = 0
+
     def __init__(self, id, revid, urlbase, title, page):
         """
         :param page: a list of lines.
@@ -942,6 +1214,32 @@ class Extractor():
         self.recursion_exceeded_2_errs = 0  # template recursion within expandTemplate()
         self.recursion_exceeded_3_errs = 0  # parameter recursion
         self.template_title_errs = 0
+        self.contextual = 0  # uses of article specific values in expansions
+        self.deepest = 0  # deepest frame reached while expanding
+        self.frames = 0  # templates instantiated
+        self.expansions = 0  # templates and parser functions expanded
+        self.deadline = 0  # time when the budget of the article is exceeded
+        self.exhausted = False  # whether the budget is exceeded
+        self.budget_exceeded_errs = 0  # templates dropped once exhausted
+        # when profiling, stage: [calls, seconds] and title: [calls, seconds]
+        self.stages = {} if self.profile is not None else None
+        self.templateTimes = {}
+        self.lapStart = 0.0
+
+    def lap(self, stage):
+        """
+        When profiling, record the time since the previous lap as spent in
+        :param stage:.
+        """
+        if self.stages is None:
+            return
+        now = default_timer()
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += now - self.lapStart
+        self.lapStart = now
 
     def clean_text(self, text, mark_headers=False, expand_templates=True,
                    html_safe=True):
@@ -949,6 +1247,8 @@ class Extractor():
         :param mark_headers: True to distinguish headers from paragraphs
           e.g. "## Section 1"
         """
+        if self.maxArticleSeconds:
+            self.deadline = default_timer() + self.maxArticleSeconds
         self.magicWords['namespace'] = self.title[:max(0, self.title.find(":"))]
         #self.magicWords['namespacenumber'] = '0' # for article, 
         self.magicWords['pagename'] = self.title
@@ -963,6 +1263,7 @@ class Extractor():
                      html_safe=html_safe)
 
         text = compact(text, mark_headers=mark_headers)
+        self.lap('compact')
         return text
 
     def extract(self, out, html_safe=True):
@@ -971,6 +1272,8 @@ class Extractor():
         :param html_safe: whether to escape HTML entities.
         """
         logging.debug("%s\t%s", self.id, self.title)
+        if self.stages is not None:
+            start = self.lapStart = default_timer()
         text = ''.join(self.page)
         text = self.clean_text(text, html_safe=html_safe)
 
@@ -994,6 +1297,9 @@ class Extractor():
             out.write('\n'.join(text))
             out.write('\n')
             out.write(footer)
+        if self.stages is not None:
+            self.lap('output')
+            self.profile.add(self, default_timer() - start)
 
         errs = (self.template_title_errs,
                 self.recursion_exceeded_1_errs,
@@ -1002,6 +1308,9 @@ class Extractor():
         if any(errs):
             logging.warn("Template errors in article '%s' (%s): title(%d) recursion(%d, %d, %d)",
                          self.title, self.id, *errs)
+        if self.exhausted:
+            logging.warning("Article '%s' (%s) exceeded its budget after %d template expansions: "
+                            "its remaining templates were dropped", self.title, self.id, self.expansions)
 
     # ----------------------------------------------------------------------
     # Expand templates
@@ -1012,6 +1321,9 @@ class Extractor():
     # check for template beginning
     reOpen = re.compile('(?<!{){{(?!{)', re.DOTALL)
 
+    # named parameter
+    reNamedParam = re.compile(" *([^=']*?) *=(.*)", re.DOTALL)
+
     def expandTemplates(self, wikitext):
         """
         :param wikitext: the text to be expanded.
@@ -1034,22 +1346,35 @@ class Extractor():
         # Test template expansion at:
         # https://en.wikipedia.org/wiki/Special:ExpandTemplates
 
-        res = ''
         if len(self.frame) >= self.maxTemplateRecursionLevels:
             self.recursion_exceeded_1_errs += 1
-            return res
+            return ''
+
+        if self.exhausted:
+            return dropNested(wikitext, r'{{', r'}}')
+
+        if self.preprocessor == 'tree':
+            # the tree is only walked for expansion: clean() scans the text it
+            # returns, where comments and tags are no longer XML-escaped
+            return self.expandTree(preprocess(wikitext))
 
         # logging.debug('<expandTemplates ' + str(len(self.frame)))
 
+        res = []
         cur = 0
         # look for matching {{...}}
         for s, e in findMatchingBraces(wikitext, 2):
-            res += wikitext[cur:s] + self.expandTemplate(wikitext[s + 2:e - 2])
+            res.append(wikitext[cur:s])
+            res.append(self.expandTemplate(wikitext[s + 2:e - 2]))
             cur = e
+            if self.exhausted:
+                # drop the remaining templates rather than expand them
+                res.append(dropNested(wikitext[cur:], r'{{', r'}}'))
+                return ''.join(res)
         # leftover
-        res += wikitext[cur:]
+        res.append(wikitext[cur:])
         # logging.debug('   expandTemplates> %d %s', len(self.frame), res)
-        return res
+        return ''.join(res)
 
     def templateParams(self, parameters):
         """
@@ -1100,7 +1425,7 @@ class Extractor():
             # The '=' might occurr within quotes:
             # ''''<span lang="pt-pt" xml:lang="pt-pt">cénicas</span>'''
 
-            m = re.match(" *([^=']*?) *=(.*)", param, re.DOTALL)
+            m = self.reNamedParam.match(param)
             if m:
                 # This is a named parameter.  This case also handles parameter
                 # assignments like "2=xxx", where the number of an unnamed
@@ -1168,6 +1493,9 @@ class Extractor():
         # part are not taken into account in this decomposition. Parts without
         # equals sign are indexed 1, 2, .., given as attribute in the <name> tag.
 
+        if self.overBudget():
+            return ''
+
         if len(self.frame) >= self.maxTemplateRecursionLevels:
             self.recursion_exceeded_2_errs += 1
             # logging.debug('   INVOCATION> %d %s', len(self.frame), body)
@@ -1186,11 +1514,13 @@ class Extractor():
         # {{subst:t|a{{{p|q}}}b}} gives the wikitext start-a{{{p|q}}}b-end
         # @see https://www.mediawiki.org/wiki/Manual:Substitution#Partial_substitution
         subst = False
-        if re.match(substWords, title, re.IGNORECASE):
-            title = re.sub(substWords, '', title, 1, re.IGNORECASE)
+        if substRE.match(title):
+            title = substRE.sub('', title, 1)
             subst = True
 
         if title.lower() in self.magicWords.values:
+            if title != '!':
+                self.contextual += 1
             return self.magicWords[title.lower()]
 
         # Parser functions
@@ -1200,6 +1530,9 @@ class Extractor():
         if colon > 1:
             funct = title[:colon]
             parts[0] = title[colon + 1:].strip()  # side-effect (parts[0] not used later)
+            if funct == '#invoke':
+                # depends on the parameters in the frame
+                self.contextual += 1
             # arguments after first are not evaluated
             ret = callParserFunction(funct, parts, self.frame)
             return self.expandTemplates(ret)
@@ -1209,19 +1542,9 @@ class Extractor():
             self.template_title_errs += 1
             return ''
 
-        redirected = redirects.get(title)
-        if redirected:
-            title = redirected
-
         # get the template
-        if title in templateCache:
-            template = templateCache[title]
-        elif title in templates:
-            template = Template.parse(templates[title])
-            # add it to cache
-            templateCache[title] = template
-            del templates[title]
-        else:
+        template = get_template(title)
+        if template is None:
             # The page being included could not be identified
             return ''
 
@@ -1266,18 +1589,241 @@ class Extractor():
         # build a dict of name-values for the parameter values
         params = self.templateParams(params)
 
+        return self.instantiate(title, subst, template, params)
+
+    def instantiate(self, title, subst, template, params):
+        """
+        Expand a template with its parameters.
+        :param title: the fully qualified title of the template.
+        :param subst: whether the invocation is a substitution.
+        :param template: the template, as returned by get_template().
+        :param params: the dict of parameter values.
+        """
+        if expansionCache.maxsize:
+            key = (title, subst, tuple(sorted(params.items())))
+            cached = expansionCache.get(key)
+            if cached:
+                value, depth = cached
+                # it must not reach the maximum depth from here
+                if len(self.frame) + depth < self.maxTemplateRecursionLevels:
+                    return value
+            dependencies = self.dependencies()
+            deepest = self.deepest
+            self.deepest = len(self.frame)
+
         # Perform parameter substitution
         # extend frame before subst, since there may be recursion in default
         # parameter value, e.g. {{OTRS|celebrative|date=April 2015}} in article
         # 21637542 in enwiki.
         self.frame.append((title, params))
-        instantiated = template.subst(params, self)
-        # logging.debug('instantiated %d %s', len(self.frame), instantiated)
-        value = self.expandTemplates(instantiated)
+        self.deepest = max(self.deepest, len(self.frame))
+        self.frames += 1
+        if self.stages is not None:
+            start = default_timer()
+        if self.preprocessor == 'tree':
+            value = self.expandTree(template, params)
+        else:
+            instantiated = template.subst(params, self)
+            # logging.debug('instantiated %d %s', len(self.frame), instantiated)
+            value = self.expandTemplates(instantiated)
         self.frame.pop()
+        if self.stages is not None:
+            # inclusive of the templates it invokes
+            entry = self.templateTimes.get(title)
+            if entry is None:
+                entry = self.templateTimes[title] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += default_timer() - start
         # logging.debug('   INVOCATION> %s %d %s', title, len(self.frame), value)
+
+        if expansionCache.maxsize:
+            if self.dependencies() == dependencies:
+                # the expansion depends only on title and parameters
+                depth = self.deepest - len(self.frame)
+                size = len(value) + sum(len(n) + len(v) for n, v in key[2])
+                expansionCache.put(key, (value, depth), size)
+            self.deepest = max(deepest, self.deepest)
         return value
 
+    # ----------------------------------------------------------------------
+    # Expand a tree built by preprocess()
+
+    def expandTree(self, nodes, params={}):
+        """
+        :param nodes: a list of nodes built by preprocess().
+        :param params: the dict of parameter values of the template being
+            instantiated.
+        :return: the expanded text.
+        """
+        res = []
+        for node in nodes:
+            kind = type(node)
+            if kind is str or kind is ExtNode:
+                res.append(node)
+            elif kind is TemplateNode:
+                res.append(self.expandTemplateNode(node, params))
+            elif kind is TplArgNode:
+                res.append(self.expandTplArg(node, params))
+            elif kind is HeadingNode:
+                res.append(self.expandTree(node.nodes, params))
+            # comments are dropped
+        return ''.join(res)
+
+    def expandTplArg(self, node, params):
+        """
+        Substitute a parameter, or its default, expanded only if used.
+        Any parts after the default are ignored.
+        """
+        # the parameter name itself might contain templates, e.g.:
+        # appointe{{#if:{{{appointer14|}}}|r|d}}14|
+        name = self.expandTree(node.parts[0].nodes, params).strip()
+        if name in params:
+            return params[name]
+        if len(node.parts) > 1:
+            return self.expandTree(node.parts[1].nodes, params)
+        return ''
+
+    def expandTemplateNode(self, node, params):
+        """
+        Expand a template invocation, as expandTemplate() does, from its
+        TemplateNode :param node:.
+        :param params: the parameter values of the enclosing template.
+        """
+        if self.overBudget():
+            return ''
+
+        if len(self.frame) >= self.maxTemplateRecursionLevels:
+            self.recursion_exceeded_2_errs += 1
+            return ''
+
+        title = self.expandTree(node.parts[0].nodes, params).strip()
+
+        subst = False
+        if substRE.match(title):
+            title = substRE.sub('', title, 1)
+            subst = True
+
+        if title.lower() in self.magicWords.values:
+            if title != '!':
+                self.contextual += 1
+            return self.magicWords[title.lower()]
+
+        colon = title.find(':')
+        if colon > 1:
+            return self.expandParserFunction(title[:colon], title[colon + 1:].strip(),
+                                             node.parts[1:], params)
+
+        title = fullyQualifiedTemplateTitle(title)
+        if not title:
+            self.template_title_errs += 1
+            return ''
+
+        template = get_template(title)
+        if template is None:
+            return ''
+
+        # named parts are split at their first equals sign, the others are
+        # numbered; values are trimmed unless they contain a link.
+        args = {}
+        unnamed = 0
+        for part in node.parts[1:]:
+            if part.eq is None:
+                unnamed += 1
+                name = str(unnamed)
+                value = self.expandTree(part.nodes, params)
+            else:
+                name = self.expandTree(part.name, params).strip()
+                value = self.expandTree(part.value, params)
+            if ']]' not in value:
+                value = value.strip()
+            args[name] = value
+
+        return self.instantiate(title, subst, template, args)
+
+    def expandParserFunction(self, funct, first, parts, params):
+        """
+        Call a parser function, expanding only the branch taken by the
+        branching ones.
+        :param funct: the name of the function.
+        :param first: the expanded first argument, after the colon.
+        :param parts: the other parts of the invocation.
+        :param params: the parameter values of the enclosing template.
+        """
+        def arg(n):
+            return self.expandTree(parts[n].nodes, params) if n < len(parts) else None
+
+        if funct == '#if':
+            value = arg(0 if first.strip() else 1)
+            return value.strip() if value else ''
+        if funct == '#ifeq':
+            rvalue = arg(0)
+            rvalue = rvalue.strip() if rvalue else ''
+            if not rvalue:
+                return ''
+            value = arg(1 if first.strip() == rvalue else 2)
+            return value.strip() if value else ''
+        if funct == '#iferror':
+            if errorRE.match(first):
+                return arg(0) or ''
+            value = arg(1)
+            return value.strip() if value is not None else first.strip()
+        if funct == '#switch':
+            return self.expandSwitch(first.strip(), parts, params)
+        if funct in ('#ifexpr', '#ifexist'):
+            return ''               # not supported
+        if funct == '#invoke':
+            # depends on the parameters in the frame
+            self.contextual += 1
+        args = [first] + [arg(n) for n in range(len(parts))]
+        return callParserFunction(funct, args, self.frame)
+
+    def expandSwitch(self, primary, parts, params):
+        """
+        Like sharp_switch(), expanding only the cases up to the one
+        matching :param primary: and its value.
+        """
+        found = False           # for fall through cases
+        default = None
+        for part in parts:
+            if part.eq is None:
+                if self.expandTree(part.nodes, params).strip() == primary:
+                    found = True
+                continue
+            lvalue = self.expandTree(part.name, params).strip()
+            # check for any of multiple values pipe separated
+            if found or primary in [v.strip() for v in lvalue.split('|')]:
+                return self.expandTree(part.value, params).strip()
+            elif lvalue == '#default':
+                default = part
+        if default is not None:
+            return self.expandTree(default.value, params).strip()
+        return ''
+
+    def overBudget(self):
+        """
+        Count an expansion against the budget of the article.
+        :return: whether the budget is exceeded, in which case the template
+            must be dropped.
+        """
+        if not self.exhausted:
+            self.expansions += 1
+            if ((self.maxArticleExpansions and self.expansions > self.maxArticleExpansions) or
+                    (self.deadline and default_timer() > self.deadline)):
+                self.exhausted = True
+        if self.exhausted:
+            self.budget_exceeded_errs += 1
+        return self.exhausted
+
+    def dependencies(self):
+        """
+        :return: a count of the values used in expansions that depend on the
+        article rather than on template parameters, and of the errors, which
+        depend on the nesting of templates.
+        """
+        return (self.contextual + self.template_title_errs +
+                self.recursion_exceeded_1_errs + self.recursion_exceeded_2_errs +
+                self.recursion_exceeded_3_errs + self.budget_exceeded_errs)
+
 
 # ----------------------------------------------------------------------
 # parameter handling
@@ -1355,6 +1901,11 @@ def splitParts(paramsList):
     return parameters
 
 
+bracesNext = re.compile('[{]{2,}|}{2,}')  # at least 2 open or close bracces
+bracesOrBracketsOpen = re.compile('{{2,}|\[{2,}')
+bracesOrBracketsNext = re.compile('{{2,}|}{2,}|\[{2,}|]{2,}')  # at least 2
+
+
 def findMatchingBraces(text, ldelim=0):
     """
     :param ldelim: number of braces to match. 0 means match [[]], {{}} and {{{}}}.
@@ -1394,11 +1945,11 @@ def findMatchingBraces(text, ldelim=0):
     #   {{{link|{{ucfirst:{{{1}}}}}} interchange}}}
 
     if ldelim:  # 2-3
-        reOpen = re.compile('[{]{%d,}' % ldelim)  # at least ldelim
-        reNext = re.compile('[{]{2,}|}{2,}')  # at least 2 open or close bracces
+        reOpen = compiled('[{]{%d,}' % ldelim)  # at least ldelim
+        reNext = bracesNext
     else:
-        reOpen = re.compile('{{2,}|\[{2,}')
-        reNext = re.compile('{{2,}|}{2,}|\[{2,}|]{2,}')  # at least 2
+        reOpen = bracesOrBracketsOpen
+        reNext = bracesOrBracketsNext
 
     cur = 0
     while True:
@@ -1474,13 +2025,13 @@ def findBalanced(text, openDelim, closeDelim):
     """
     openPat = '|'.join([re.escape(x) for x in openDelim])
     # patter for delimiters expected after each opening delimiter
-    afterPat = {o: re.compile(openPat + '|' + c, re.DOTALL) for o, c in zip(openDelim, closeDelim)}
+    afterPat = {o: compiled(openPat + '|' + c, re.DOTALL) for o, c in zip(openDelim, closeDelim)}
     stack = []
     start = 0
     cur = 0
     # end = len(text)
     startSet = False
-    startPat = re.compile(openPat)
+    startPat = compiled(openPat)
     nextPat = startPat
     while True:
         next = nextPat.search(text, cur)
@@ -1533,6 +2084,9 @@ def lcfirst(string):
         return ''
 
 
+titlePrefix = re.compile('([^:]*)(:.*)')
+
+
 def fullyQualifiedTemplateTitle(templateTitle):
     """
     Determine the namespace of the page being included through the template
@@ -1542,7 +2096,7 @@ def fullyQualifiedTemplateTitle(templateTitle):
         # Leading colon by itself implies main namespace, so strip this colon
         return ucfirst(templateTitle[1:])
     else:
-        m = re.match('([^:]*)(:.*)', templateTitle)
+        m = titlePrefix.match(templateTitle)
         if m:
             # colon found but not in the first position - check if it
             # designates a known namespace
@@ -1605,12 +2159,18 @@ class Infix():
 ROUND = Infix(lambda x, y: round(x, y))
 
 
+exprEquals = re.compile('=')
+exprMod = re.compile('mod')
+exprDiv = re.compile('\bdiv\b')
+exprRound = re.compile('\bround\b')
+
+
 def sharp_expr(expr):
     try:
-        expr = re.sub('=', '==', expr)
-        expr = re.sub('mod', '%', expr)
-        expr = re.sub('\bdiv\b', '/', expr)
-        expr = re.sub('\bround\b', '|ROUND|', expr)
+        expr = exprEquals.sub('==', expr)
+        expr = exprMod.sub('%', expr)
+        expr = exprDiv.sub('/', expr)
+        expr = exprRound.sub('|ROUND|', expr)
         return str(eval(expr))
     except:
         return '<span class="error"></span>'
@@ -1648,8 +2208,11 @@ def sharp_ifeq(lvalue, rvalue, valueIfTrue, valueIfFalse=None, *args):
     return ""
 
 
+errorRE = re.compile('<(?:strong|span|p|div)\s(?:[^\s>]*\s+)*?class="(?:[^"\s>]*\s+)*?error(?:\s[^">]*)?"')
+
+
 def sharp_iferror(test, then='', Else=None, *args):
-    if re.match('<(?:strong|span|p|div)\s(?:[^\s>]*\s+)*?class="(?:[^"\s>]*\s+)*?error(?:\s[^">]*)?"', test):
+    if errorRE.match(test):
         return then
     elif Else is None:
         return test.strip()
@@ -1800,13 +2363,96 @@ def callParserFunction(functionName, args, frame):
 
 reNoinclude = re.compile(r'<noinclude>(?:.*?)</noinclude>', re.DOTALL)
 reIncludeonly = re.compile(r'<includeonly>|</includeonly>', re.DOTALL)
+reNoincludeUnterminated = re.compile(r'<noinclude\s*>.*$', re.DOTALL)
+reNoincludeEmpty = re.compile(r'<noinclude/>')
+reOnlyinclude = re.compile('<onlyinclude>(.*?)</onlyinclude>', re.DOTALL)
+reRedirect = re.compile('#REDIRECT.*?\[\[([^\]]*)]]', re.IGNORECASE)
 
 # These are built before spawning processes, hence they are shared.
 templates = {}
 redirects = {}
-# cache of parser templates
-# FIXME: sharing this with a Manager slows down.
-templateCache = {}
+
+
+class LRUCache():
+    """
+    A cache of bounded size, which evicts its least recently used entries.
+    Entries pinned with pin() are never evicted.
+    It keeps counts of hits and misses, to help sizing it.
+    """
+
+    def __init__(self, maxsize=0):
+        """
+        :param maxsize: maximum total size of entries, 0 for no limit.
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.size = 0
+        self.pinned = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries) + len(self.pinned)
+
+    def get(self, key):
+        """
+        :return: the value cached for :param key:, or None.
+        """
+        value = self.pinned.get(key)
+        if value is None:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, size=1):
+        """
+        :param size: the size of the entry, by default each entry counts 1.
+        """
+        if self.maxsize and size > self.maxsize:
+            return
+        if key in self.entries:
+            self.size -= self.sizes[key]
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.sizes[key] = size
+        self.size += size
+        while self.maxsize and self.size > self.maxsize:
+            key, _ = self.entries.popitem(last=False)
+            self.size -= self.sizes.pop(key)
+
+    def pin(self, key, value):
+        self.pinned[key] = value
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.size = 0
+        self.pinned.clear()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return '%d entries, %d hits, %d misses (%.1f%% hit rate)' % (
+            len(self), self.hits, self.misses, 100 * self.hit_rate())
+
+
+# cache of parser templates, private to each process, except for those
+# pinned by preload_templates() before spawning processes.
+# Sharing it through a Manager is too slow.
+templateCache = LRUCache()
+
+# cache of template expansions, by template title and parameters, whose
+# maxsize is in characters: 0 disables it.
+expansionCache = LRUCache()
+# database of parsed templates, used in place of templates and redirects
+templateDB = None
 
 
 def define_template(title, page):
@@ -1820,7 +2466,7 @@ def define_template(title, page):
     # title = normalizeTitle(title)
 
     # check for redirects
-    m = re.match('#REDIRECT.*?\[\[([^\]]*)]]', page[0], re.IGNORECASE)
+    m = reRedirect.match(page[0])
     if m:
         redirects[title] = m.group(1)  # normalizeTitle(m.group(1))
         return
@@ -1842,12 +2488,10 @@ def define_template(title, page):
     # eliminate <noinclude> fragments
     text = reNoinclude.sub('', text)
     # eliminate unterminated <noinclude> elements
-    text = re.sub(r'<noinclude\s*>.*$', '', text, flags=re.DOTALL)
-    text = re.sub(r'<noinclude/>', '', text)
+    text = reNoincludeUnterminated.sub('', text)
+    text = reNoincludeEmpty.sub('', text)
 
-    onlyincludeAccumulator = ''
-    for m in re.finditer('<onlyinclude>(.*?)</onlyinclude>', text, re.DOTALL):
-        onlyincludeAccumulator += m.group(1)
+    onlyincludeAccumulator = ''.join(m.group(1) for m in reOnlyinclude.finditer(text))
     if onlyincludeAccumulator:
         text = onlyincludeAccumulator
     else:
@@ -1857,3 +2501,206 @@ def define_template(title, page):
         if title in templates and templates[title] != text:
             logging.warn('Redefining: %s', title)
         templates[title] = text
+
+
+def parse_template(body):
+    """
+    :return: the template with :param body:, parsed as required by
+        Extractor.preprocessor.
+    """
+    if Extractor.preprocessor == 'tree':
+        return preprocess(body)
+    return Template.parse(body)
+
+
+def get_template(title):
+    """
+    :param title: the fully qualified title of a template.
+    :return: the parsed Template, following redirects, or None if the template
+        is not defined.
+    """
+    redirected = redirects.get(title)
+    if redirected:
+        title = redirected
+    elif templateDB:
+        title = templateDB.redirect(title)
+
+    template = templateCache.get(title)
+    if template is not None:
+        return template
+    if title in templates:
+        # keep the definition, since the template may be evicted from cache
+        template = parse_template(templates[title])
+    elif templateDB:
+        if Extractor.preprocessor == 'tree':
+            body = templateDB.body(title)
+            template = preprocess(body) if body is not None else None
+        else:
+            template = templateDB.template(title)
+        if template is None:
+            return None
+    else:
+        return None
+    # add it to cache
+    templateCache.put(title, template)
+    return template
+
+
+# Match the title of a template invocation
+transclusionRE = re.compile(r'(?<!{){{(?!{)\s*([^{}|#\n]+?)\s*(?:\||}})')
+
+
+def count_transclusions(bodies):
+    """
+    Count how many times each template is invoked in :param bodies:.
+    :return: a Counter of fully qualified template titles.
+    """
+    uses = Counter()
+    for body in bodies:
+        for name in transclusionRE.findall(body):
+            title = fullyQualifiedTemplateTitle(name)
+            uses[redirects.get(title, title)] += 1
+    return uses
+
+
+def preload_templates(count):
+    """
+    Parse the :param count: templates most often transcluded by other
+    templates and pin them in templateCache.
+    When called before spawning processes, these are shared among them,
+    rather than parsed again by each.
+    :return: the number of templates preloaded.
+    """
+    if templateDB:
+        preloaded = templateDB.most_used(count)
+        if Extractor.preprocessor == 'tree':
+            preloaded = [(title, preprocess(templateDB.body(title))) for title, _ in preloaded]
+    else:
+        uses = count_transclusions(templates.values())
+        preloaded = [(title, parse_template(templates[title]))
+                     for title, _ in uses.most_common() if title in templates][:count]
+    for title, template in preloaded:
+        templateCache.pin(title, template)
+    return len(preloaded)
+
+
+def read_only_uri(filename):
+    """
+    :return: the URI to open the SQLite database :param filename: read only,
+        with the characters special in URIs, like ? # %, quoted.
+    """
+    return Path(filename).resolve().as_uri() + '?mode=ro'
+
+
+class TemplateDB():
+    """
+    Persistent store of template definitions, kept in an SQLite database.
+    It holds the template bodies, cleaned by define_template(), together with
+    their parsed Template, as well as template redirects, so that they need
+    not be collected from the dump on each run.
+    Entries are loaded on demand: each process opens its own read-only
+    connection.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: the database file, built by TemplateDB.build().
+        """
+        self.filename = filename
+        self.connection = None
+        self.pid = None
+        self.resolved = {}      # redirects already looked up
+
+    @classmethod
+    def build(cls, filename, templates, redirects, templatePrefix):
+        """
+        Create the database :param filename: from the dictionaries of
+        :param templates: and :param redirects: filled by define_template().
+        :param templatePrefix: the template namespace prefix, e.g. 'Template:'.
+        """
+        if os.path.exists(filename):
+            os.remove(filename)
+        db = sqlite3.connect(filename)
+        db.execute('CREATE TABLE templates (title TEXT PRIMARY KEY, body TEXT, tree BLOB, uses INTEGER)')
+        db.execute('CREATE TABLE redirects (title TEXT PRIMARY KEY, target TEXT)')
+        db.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+        uses = count_transclusions(templates.values())
+        db.executemany('INSERT INTO templates VALUES (?, ?, ?, ?)',
+                       ((title, body, pickle.dumps(Template.parse(body), pickle.HIGHEST_PROTOCOL),
+                         uses[title])
+                        for title, body in templates.items()))
+        db.executemany('INSERT INTO redirects VALUES (?, ?)', redirects.items())
+        db.execute('INSERT INTO info VALUES (?, ?)', ('templatePrefix', templatePrefix))
+        db.commit()
+        db.close()
+
+    def execute(self, query, args=()):
+        if self.pid != os.getpid():
+            # a connection cannot be shared with forked processes
+            self.connection = sqlite3.connect(read_only_uri(self.filename), uri=True)
+            self.pid = os.getpid()
+        return self.connection.execute(query, args)
+
+    def __len__(self):
+        return self.execute('SELECT COUNT(*) FROM templates').fetchone()[0]
+
+    def info(self, key):
+        row = self.execute('SELECT value FROM info WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def redirect(self, title):
+        """
+        :return: the title that :param title: redirects to, or itself.
+        """
+        target = self.resolved.get(title)
+        if target is None:
+            row = self.execute('SELECT target FROM redirects WHERE title = ?', (title,)).fetchone()
+            target = row[0] if row else title
+            self.resolved[title] = target
+        return target
+
+    def template(self, title):
+        """
+        :return: the parsed Template with :param title:, or None.
+        """
+        row = self.execute('SELECT tree FROM templates WHERE title = ?', (title,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def most_used(self, count):
+        """
+        :return: a list of pairs (title, Template) of the :param count:
+            templates most often transcluded by other templates.
+        """
+        rows = self.execute('SELECT title, tree FROM templates ORDER BY uses DESC LIMIT ?', (count,))
+        return [(title, pickle.loads(tree)) for title, tree in rows]
+
+    def body(self, title):
+        """
+        :return: the body of the template with :param title:, or None.
+        """
+        row = self.execute('SELECT body FROM templates WHERE title = ?', (title,)).fetchone()
+        return row[0] if row else None
+
+
+def save_template_db(filename):
+    """
+    Save the template definitions collected by define_template() into a
+    TemplateDB in :param filename:.
+    """
+    TemplateDB.build(filename, templates, redirects, Extractor.templatePrefix)
+
+
+def use_template_db(filename):
+    """
+    Take template definitions from the TemplateDB in :param filename:,
+    rather than from those collected by define_template().
+    :return: the TemplateDB.
+    """
+    global templateDB
+    templateDB = TemplateDB(filename)
+    templates.clear()
+    redirects.clear()
+    templatePrefix = templateDB.info('templatePrefix')
+    if templatePrefix and not Extractor.templatePrefix:
+        Extractor.templatePrefix = templatePrefix
+    return templateDB
@@ -25,12 +25,22 @@
 
 """Wikipedia Page Extractor:
 Extracts a single page from a Wikipedia dump file.
+
+With a page index, built once from the index of a multistream dump, a page is
+fetched by decompressing only the stream that holds it, instead of scanning
+the whole dump.
 """
 
 import sys, os.path
 import re
 import argparse
 import bz2
+import html
+import sqlite3
+from io import StringIO
+
+from .WikiExtractor import decode_open, read_block, read_pages
+from .extract import Extractor, read_only_uri, use_template_db
 
 
 # Program version
@@ -43,59 +53,204 @@ tagRE = re.compile(r'(.*?)<(/?\w+)[^>]*>(?:([^<]*)(<.*?>)?)?')
 #tagRE = re.compile(r'(.*?)<(/?\w+)[^>]*>([^<]*)')
 #                    1     2            3
 
-def process_data(input_file, id, templates=False):
+def process_data(input_file, id, templates=False, title=None):
     """
+    Print the XML of a page, scanning the dump for it.
     :param input_file: name of the wikipedia dump file.
     :param id: article id.
-    :param templates: whether article is a template.
+    :param templates: whether article is a template, whose title may be
+        given without the 'Template:' prefix.
+    :param title: article title, in place of its id.
+    :return: whether the page was found.
     """
+    if title and templates and not title.startswith('Template:'):
+        title = 'Template:' + title
 
     if input_file.lower().endswith(".bz2"):
         input = bz2.open(input_file, mode='rt', encoding='utf-8')
     else:
         input = open(input_file)
 
-    page = []
+    found = False
+    page = []                   # lines of the page, while it may be the one
+    pageId = None
     for line in input:
-        line = line
         if '<' not in line:         # faster than doing re.search()
             if page:
                 page.append(line)
             continue
         m = tagRE.search(line)
         if not m:
+            if page:
+                page.append(line)
             continue
         tag = m.group(2)
         if tag == 'page':
-            page = []
+            page = [line]
+            pageId = None
+        elif not page:
+            continue
+        else:
             page.append(line)
-            inArticle = False
-        elif tag == 'id':
-            curid = m.group(3)
-            if id == curid:
-                page.append(line)
-                inArticle = True
-            elif not inArticle and not templates:
-                page = []
-        elif tag == 'title':
-            if templates:
-                if m.group(3).startswith('Template:'):
-                    page.append(line)
-                else:
+            if tag == 'title' and title:
+                if html.unescape(m.group(3)) != title:
                     page = []
-            else:
-                page.append(line)
-        elif tag == '/page':
-            if page:
-                page.append(line)
+            elif tag == 'id' and pageId is None:
+                # the first id of a page is its own, then come those of revisions
+                pageId = m.group(3)
+                if not title and pageId != id:
+                    page = []
+            elif tag == '/page':
                 print(''.join(page))
-                if not templates:
-                    break
-            page = []
-        elif page:
-            page.append(line)
+                found = True
+                break
 
     input.close()
+    return found
+
+# ----------------------------------------------------------------------
+# PAGE INDEX
+
+class PageIndex():
+    """
+    Persistent index of the pages of a multistream dump, kept in an SQLite
+    database: for each page id, its title and the byte range of the bz2
+    stream holding it, and for each title, the page id.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: the database file, built by PageIndex.build().
+        """
+        self.filename = filename
+        self.connection = sqlite3.connect(read_only_uri(filename), uri=True)
+
+    @classmethod
+    def build(cls, filename, index_file, input_file):
+        """
+        Create the database :param filename: from the index :param index_file:
+        of the multistream dump :param input_file:, whose lines have the form
+        offset:id:title.
+        :return: the number of pages indexed.
+        """
+        if os.path.exists(filename):
+            os.remove(filename)
+        db = sqlite3.connect(filename)
+        db.execute('CREATE TABLE pages (id INTEGER PRIMARY KEY, title TEXT, start INTEGER, end INTEGER)')
+        db.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+
+        def entries():
+            # the pages of a stream end where the next stream starts
+            stream = []
+            start = None
+            with decode_open(index_file) as index:
+                for line in index:
+                    offset, id, title = line.rstrip('\n').split(':', 2)
+                    offset = int(offset)
+                    if offset != start:
+                        for id_title in stream:
+                            yield id_title + (start, offset)
+                        stream = []
+                        start = offset
+                    stream.append((int(id), html.unescape(title)))
+            for id_title in stream:
+                yield id_title + (start, None)
+
+        db.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)', entries())
+        db.execute('CREATE INDEX titles ON pages (title)')
+        # the first stream holds the <siteinfo>
+        first = db.execute('SELECT MIN(start) FROM pages').fetchone()[0]
+        if first:
+            with open(input_file, 'rb') as input:
+                siteinfo = read_block(input, 0, first)
+            for line in siteinfo.splitlines():
+                m = tagRE.search(line)
+                if not m:
+                    continue
+                if m.group(2) == 'base':
+                    base = m.group(3)
+                    db.execute('INSERT INTO info VALUES (?, ?)', ('urlbase', base[:base.rfind("/")]))
+                elif m.group(2) == 'namespace' and 'key="10"' in line:
+                    db.execute('INSERT INTO info VALUES (?, ?)', ('templatePrefix', m.group(3) + ':'))
+        pages = db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+        db.commit()
+        db.close()
+        return pages
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def info(self, key):
+        row = self.connection.execute('SELECT value FROM info WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, id=None, title=None):
+        """
+        :return: (id, title, start, end) of the page with :param id:, or
+            with :param title:, or None if there is none.
+        """
+        if id is not None:
+            return self.connection.execute('SELECT id, title, start, end FROM pages WHERE id = ?',
+                                           (int(id),)).fetchone()
+        return self.connection.execute('SELECT id, title, start, end FROM pages WHERE title = ?',
+                                       (title,)).fetchone()
+
+
+idRE = re.compile(r'<id>(\d+)</id>')
+
+
+def get_page(input_file, page_index, id=None, title=None):
+    """
+    Fetch a page from a multistream dump.
+    :param input_file: name of the multistream dump file.
+    :param page_index: the PageIndex of the dump.
+    :param id: the id of the page, or else
+    :param title: its title.
+    :return: the XML of the page, or None if there is no such page.
+    """
+    entry = page_index.lookup(id, title)
+    if not entry:
+        return None
+    id, _, start, end = entry
+    with open(input_file, 'rb') as input:
+        block = read_block(input, start, end)
+    # the id of a page is the first one after <page>
+    begin = block.find('<page>')
+    while begin >= 0:
+        finish = block.find('</page>', begin)
+        if finish < 0:
+            break
+        finish += len('</page>')
+        m = idRE.search(block, begin, finish)
+        if m and int(m.group(1)) == id:
+            return block[block.rfind('\n', 0, begin) + 1:finish] + '\n'
+        begin = block.find('<page>', finish)
+    return None
+
+
+def extract_page(input_file, page_index, id=None, title=None, html_safe=True):
+    """
+    Fetch and extract a page, or template, from a multistream dump.
+    Templates are expanded from those loaded by use_template_db(), if any.
+    :param input_file: name of the multistream dump file.
+    :param page_index: the PageIndex of the dump.
+    :param id: the id of the page, or else
+    :param title: its title.
+    :param html_safe: whether to convert entities in text to HTML.
+    :return: the extracted text, or None if there is no such page.
+    """
+    page = get_page(input_file, page_index, id, title)
+    if page is None:
+        return None
+    templatePrefix = page_index.info('templatePrefix')
+    if templatePrefix and not Extractor.templatePrefix:
+        Extractor.templatePrefix = templatePrefix
+    urlbase = page_index.info('urlbase') or ''
+    out = StringIO()
+    for id, revid, title, _, text in read_pages(StringIO(page)):
+        Extractor(id, revid, urlbase, title, text).extract(out, html_safe)
+    return out.getvalue()
+
 
 def main():
     parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
@@ -105,15 +260,56 @@ def main():
                         help="XML wiki dump file")
     parser.add_argument("--id", default="1",
                         help="article number")
+    parser.add_argument("--title",
+                        help="article title, in place of its number")
     parser.add_argument("--template", action="store_true",
-                        help="whether article is a template")
+                        help="whether article is a template, whose title may omit the template prefix")
+    parser.add_argument("--page-index", metavar="FILE",
+                        help="index of the pages of a multistream dump, to fetch a page without "
+                        "scanning the dump; built from --index if it does not exist")
+    parser.add_argument("--index", metavar="FILE",
+                        help="index file of the multistream dump, to build the page index from")
+    parser.add_argument("--extract", action="store_true",
+                        help="print the extracted text of the page rather than its XML "
+                        "(requires --page-index)")
+    parser.add_argument("--templates-db", metavar="FILE",
+                        help="template database of WikiExtractor, to expand templates with --extract")
     parser.add_argument("-v", "--version", action="version",
                         version='%(prog)s ' + __version__,
                         help="print program version")
 
     args = parser.parse_args()
 
-    process_data(args.input, args.id, args.template)
+    if not args.page_index:
+        if args.extract:
+            parser.error("--extract requires --page-index")
+        if not process_data(args.input, args.id, args.template, args.title):
+            print("No page %s" % (args.title or args.id), file=sys.stderr)
+            sys.exit(1)
+        return
+
+    if not os.path.exists(args.page_index):
+        if not args.index:
+            parser.error("page index %s does not exist, give --index to build it" % args.page_index)
+        pages = PageIndex.build(args.page_index, args.index, args.input)
+        print("Indexed %d pages in %s" % (pages, args.page_index), file=sys.stderr)
+    page_index = PageIndex(args.page_index)
+    title = args.title
+    if title and args.template:
+        prefix = page_index.info('templatePrefix') or 'Template:'
+        if not title.startswith(prefix):
+            title = prefix + title
+    id = None if title else args.id
+    if args.extract:
+        if args.templates_db:
+            use_template_db(args.templates_db)
+        text = extract_page(args.input, page_index, id, title)
+    else:
+        text = get_page(args.input, page_index, id, title)
+    if text is None:
+        print("No page %s" % (title or id), file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(text)
 
 if __name__ == '__main__':
     main()
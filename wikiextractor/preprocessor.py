@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+#  Copyright (c) 2020. Giuseppe Attardi (attardi@di.unipi.it).
+# =============================================================================
+#  This file is part of Tanl.
+#
+#  Tanl is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License, version 3,
+#  as published by the Free Software Foundation.
+#
+#  Tanl is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# =============================================================================
+
+"""
+Preprocessor of wikitext, modeled on Preprocessor_Hash of MediaWiki:
+https://doc.wikimedia.org/mediawiki-core/master/php/classMediaWiki_1_1Parser_1_1Preprocessor__Hash.html
+
+A text is tokenized once into a tree, whose nodes are plain strings for
+literal text and:
+
+    TemplateNode    {{title|part|name=value}}
+    TplArgNode      {{{name|default}}}
+    CommentNode     <!-- ... -->
+    ExtNode         <nowiki>...</nowiki> and other tags whose content is
+                    not wikitext
+    HeadingNode     == title ==
+
+Templates and tplargs are split into parts at the pipes which are not
+inside inner templates, tplargs or links, and parts into name and value at
+their first such equals sign.
+Ambiguous braces are resolved as in MediaWiki:
+    {{{{ }}}} -> { {{{ }}} }
+    {{{{{ }}}}} -> {{ {{{ }}} }}
+"""
+
+import re
+
+# ----------------------------------------------------------------------
+# Nodes
+
+
+class Part():
+    """
+    A part of a template or tplarg: the list of its nodes, and the index of
+    the equals sign between name and value among them, if any.
+    """
+
+    __slots__ = ('nodes', 'eq')
+
+    def __init__(self, nodes=None):
+        self.nodes = nodes if nodes is not None else []
+        self.eq = None
+
+    @property
+    def name(self):
+        return self.nodes[:self.eq]
+
+    @property
+    def value(self):
+        return self.nodes[self.eq + 1:]
+
+    def __str__(self):
+        return ''.join(map(str, self.nodes))
+
+
+class TemplateNode():
+    """Template invocation or parser function: parts[0] is the title."""
+
+    __slots__ = ('parts',)
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def __str__(self):
+        return '{{%s}}' % '|'.join(map(str, self.parts))
+
+
+class TplArgNode():
+    """Template parameter: parts[0] is the name, parts[1] the default."""
+
+    __slots__ = ('parts',)
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def __str__(self):
+        return '{{{%s}}}' % '|'.join(map(str, self.parts))
+
+
+class CommentNode(str):
+    """HTML comment, possibly unterminated."""
+
+    __slots__ = ()
+
+
+class ExtNode(str):
+    """Element whose content is not wikitext, e.g. <nowiki>."""
+
+    __slots__ = ()
+
+
+class HeadingNode():
+    """Section heading: nodes include the equal signs around the title."""
+
+    __slots__ = ('level', 'nodes')
+
+    def __init__(self, level, nodes):
+        self.level = level
+        self.nodes = nodes
+
+    def __str__(self):
+        return ''.join(map(str, self.nodes))
+
+
+# ----------------------------------------------------------------------
+# Tokenizer
+
+##
+# Tags whose content is not parsed as wikitext.
+extTags = ('nowiki', 'pre', 'math', 'chem', 'ce', 'source', 'syntaxhighlight',
+           'score', 'timeline', 'templatedata', 'hiero', 'graph')
+
+extOpen = re.compile(r'<(%s)(?:\s[^>]*?)?(/?)>' % '|'.join(extTags), re.IGNORECASE)
+extClose = {tag: re.compile(r'</%s\s*>' % tag, re.IGNORECASE) for tag in extTags}
+
+# rules for brackets: closing char, {count: name}, minimum count
+braceRules = {
+    '{': ('}', {2: TemplateNode, 3: TplArgNode}, 2),
+    '[': (']', {2: None}, 2),
+}
+
+# characters to look for, depending on the innermost open element
+searchPatterns = {}
+
+
+def searchPattern(close, pipe, equals):
+    key = (close, pipe, equals)
+    pattern = searchPatterns.get(key)
+    if pattern is None:
+        chars = '{[<\n' + close + ('|' if pipe else '') + ('=' if equals else '')
+        pattern = searchPatterns[key] = re.compile('[%s]' % re.escape(chars))
+    return pattern
+
+
+class Element():
+    """An open element on the stack of the tokenizer."""
+
+    __slots__ = ('open', 'close', 'count', 'parts')
+
+    def __init__(self, open, close, count, nodes=None):
+        self.open = open
+        self.close = close
+        self.count = count
+        self.parts = [Part(nodes)]
+
+    def literal(self):
+        """
+        :return: the nodes of the element, if it is not closed.
+        """
+        nodes = [self.open * self.count] if self.open != '\n' else []
+        for i, part in enumerate(self.parts):
+            if i:
+                nodes.append('|')
+            nodes.extend(part.nodes)
+        return nodes
+
+
+def closeHeading(element):
+    """
+    :return: the nodes of a heading element at the end of its line.
+    """
+    nodes = element.parts[0].nodes
+    # the text at the end of the line, ignoring comments
+    tail = []
+    for node in reversed(nodes):
+        if isinstance(node, CommentNode):
+            continue
+        if type(node) is not str:
+            break
+        tail.append(node)
+    text = ''.join(reversed(tail)).rstrip(' \t')
+    equals = len(text) - len(text.rstrip('='))
+    if not equals:
+        return nodes
+    if equals == len(text) and len(tail) == len(nodes):
+        # a line of just equal signs: === is a level 1 heading of '='
+        level = (equals - 1) // 2
+    else:
+        level = min(element.count, equals)
+    if level < 1:
+        return nodes
+    return [HeadingNode(min(level, 6), nodes)]
+
+
+def preprocess(text):
+    """
+    Tokenize :param text: into a tree.
+    :return: the list of the top level nodes.
+    """
+    root = []
+    stack = []
+    accum = root                # nodes of the current part
+    i = 0
+    length = len(text)
+    if text.startswith('='):
+        count = 0
+        while count < length and text[count] == '=':
+            count += 1
+        stack.append(Element('\n', '\n', count, ['=' * count]))
+        accum = stack[-1].parts[-1].nodes
+        i = count
+    while i < length:
+        if stack:
+            top = stack[-1]
+            if top.open == '{':
+                pattern = searchPattern('}', True, len(top.parts) > 1 and top.parts[-1].eq is None)
+            elif top.open == '[':
+                pattern = searchPattern(']', False, False)
+            else:               # heading
+                pattern = searchPattern('', False, True)
+        else:
+            top = None
+            pattern = searchPattern('', False, False)
+        m = pattern.search(text, i)
+        if not m:
+            accum.append(text[i:])
+            break
+        pos = m.start()
+        if pos > i:
+            accum.append(text[i:pos])
+        i = pos
+        c = text[i]
+
+        if c == '<':
+            if text.startswith('<!--', i):
+                end = text.find('-->', i + 4)
+                end = end + 3 if end >= 0 else length
+                accum.append(CommentNode(text[i:end]))
+                i = end
+                continue
+            m = extOpen.match(text, i)
+            if m:
+                if m.group(2):  # self-closing
+                    accum.append(ExtNode(m.group(0)))
+                    i = m.end()
+                    continue
+                close = extClose[m.group(1).lower()].search(text, m.end())
+                if close:
+                    accum.append(ExtNode(text[i:close.end()]))
+                    i = close.end()
+                    continue
+            accum.append('<')
+            i += 1
+
+        elif c == '\n':
+            if top and top.open == '\n':
+                # end of heading
+                stack.pop()
+                accum = stack[-1].parts[-1].nodes if stack else root
+                accum.extend(closeHeading(top))
+                continue
+            accum.append('\n')
+            i += 1
+            if text.startswith('=', i):
+                count = 0
+                while i + count < length and text[i + count] == '=':
+                    count += 1
+                stack.append(Element('\n', '\n', count, ['=' * count]))
+                accum = stack[-1].parts[-1].nodes
+                i += count
+
+        elif c in '{[':
+            count = 1
+            while i + count < length and text[i + count] == c:
+                count += 1
+            close, names, minimum = braceRules[c]
+            if count >= minimum:
+                stack.append(Element(c, close, count))
+                accum = stack[-1].parts[-1].nodes
+            else:
+                accum.append(c * count)
+            i += count
+
+        elif top and c == top.close:
+            count = 1
+            while i + count < length and text[i + count] == c:
+                count += 1
+            _, names, minimum = braceRules[top.open]
+            matching = min(count, top.count)
+            while matching > 0 and matching not in names:
+                matching -= 1
+            if matching <= 0:
+                accum.append(c * count)
+                i += count
+                continue
+            i += matching
+            stack.pop()
+            cls = names[matching]
+            if cls:
+                nodes = [cls(top.parts)]
+            else:
+                # links are literal text: they only hide pipes and equal signs
+                nodes = [top.open * matching] + top.parts[0].nodes + [top.close * matching]
+            remaining = top.count - matching
+            if remaining >= minimum:
+                stack.append(Element(top.open, top.close, remaining, nodes))
+                accum = stack[-1].parts[-1].nodes
+            else:
+                accum = stack[-1].parts[-1].nodes if stack else root
+                if remaining:
+                    accum.append(top.open * remaining)
+                accum.extend(nodes)
+
+        elif c == '|':
+            top.parts.append(Part())
+            accum = top.parts[-1].nodes
+            i += 1
+
+        else:                   # '='
+            if top.open == '{':
+                top.parts[-1].eq = len(accum)
+            accum.append('=')
+            i += 1
+
+    # close whatever is still open
+    while stack:
+        top = stack.pop()
+        accum = stack[-1].parts[-1].nodes if stack else root
+        if top.open == '\n':
+            accum.extend(closeHeading(top))
+        else:
+            accum.extend(top.literal())
+    return root
+
+
+def toText(nodes):
+    """
+    :return: the text that :param nodes: were obtained from.
+    """
+    return ''.join(map(str, nodes))